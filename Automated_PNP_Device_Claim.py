@@ -3,63 +3,62 @@ __credits__ = ["Saurabh & Alexios"]
 __email__ = "saushar2@cisco.com"
 __version__ = "1.0"
 
+import argparse
 import getpass
+from concurrent.futures import ThreadPoolExecutor
 from csv import DictReader
-import requests
-import urllib3
+from dnac import get_client, get_auth_token
+from inventory_cache import InventoryCache
+from pnp_claim import site_claim_devices
+from pnp_inventory import PnPInventory
+from pnp_tracker import OnboardingTracker
+from site_index import SiteIndex
 
-urllib3.disable_warnings()
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument("--refresh", action="store_true", help="Ignore the cached sites and re-read them from DNAC")
+arg_parser.add_argument("--no-track", action="store_true", help="Don't follow claimed devices until they are provisioned")
+arg_parser.add_argument("--track-timeout", default=60, type=int,
+                        help="Minutes after the claim a device still onboarding is reported as stuck")
 
 
-# DNAC uses basic auth and a short-lived token is used for making API calls
-def get_auth_token(base_url, username, password):
-    try:
-        url = f'{base_url}/dna/system/api/v1/auth/token'
-        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-
-        # Make the POST Request to get a Token
-        response = requests.post(url, auth=(username, password), headers=headers, verify=False)
-
-        if response.status_code == 401 or response.status_code == 403:
-            print()
-            print("Issue with credentials!")
-            print()
-
-            return
-
-        # Validate Response
-        if 'error' in response.json():
-            print()
-            print('ERROR: Failed to retrieve Access Token!')
-            print(f"REASON: {response.json()['error']}")
+def get_credential_ids(env):
+    # ["CLI", "SNMPV2_READ_COMMUNITY", "SNMPV2_WRITE_COMMUNITY", "SNMPV3", "HTTP_WRITE", "HTTP_READ", "NETCONF"]
+    cred_type = ["CLI", "SNMPV3"]  # Cap1 only uses these 2
+    response = []
+    client = get_client(env)
 
-        else:
-            return response.json()['Token']  # return only the token
+    def get_credentials(cred):
+        return client.get(f"/dna/intent/api/v1/global-credential?credentialSubType={cred}").json()["response"]
 
-    except Exception as e:
-        print(e)
-        return
+    with ThreadPoolExecutor(max_workers=len(cred_type)) as executor:  # One request per type, all at once
+        for resp in executor.map(get_credentials, cred_type):
+            for item in resp:
+                response.append(item["id"])
 
+    return response
 
-def get_credential_ids(base_url, token):
-    # ["CLI", "SNMPV2_READ_COMMUNITY", "SNMPV2_WRITE_COMMUNITY", "SNMPV3", "HTTP_WRITE", "HTTP_READ", "NETCONF"]
-    cred_type = ["CLI", "SNMPV3"]  # Cap1 only uses these 2
-    response = []
 
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
+# Read everything the claim needs at once: the claimable (Unclaimed/Planned) PnP devices, the site index and the
+# global credential ids. Returns (pnp inventory, site index, credential ids). The site read opens its own cache
+# connection since sqlite connections can't be shared between threads.
+def prefetch(env, refresh=False):
+    def pnp_devices():  # Only the claimable states are read, never the whole PnP table
+        inventory = PnPInventory(env)
+        inventory.sync(["Unclaimed", "Planned"])
+        return inventory
 
-    for cred in cred_type:
-        url = f"https://{base_url}/dna/intent/api/v1/global-credential?credentialSubType={cred}"
-        # print(url)
-        resp = requests.request("GET", url, headers=headers, verify=False).json()["response"]
+    def sites():
+        cache = InventoryCache()
+        index = SiteIndex(cache.sites(env, refresh=refresh))
+        cache.close()
+        return index
 
-        for item in resp:
-            response.append(item["id"])
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        pnp_future = executor.submit(pnp_devices)
+        sites_future = executor.submit(sites)
+        credentials_future = executor.submit(get_credential_ids, env)
 
-    return response
+        return pnp_future.result(), sites_future.result(), credentials_future.result()
 
 
 # readserialnumber
@@ -76,128 +75,6 @@ def read_sn_csv(file_name):
     return sn_list, var_list
 
 
-def claim_site_pnp(base_url, token, deviceid, hostname, variables, template_id=None):
-    endpoint = "/api/v1/onboarding/pnp-device/site-claim"
-
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
-    body = {
-        "siteId": variables[3],
-        "deviceId": deviceid,
-        "hostname": hostname,
-        "type": "Default",
-        "imageInfo": {
-            "imageId": "",
-            "skip": False,
-            "removeInactive": True
-        },
-        "configInfo": {
-            "configId": "e1825fc0-655f-464b-bee0-cfda47c87222",
-            "configParameters": [
-                {
-                    "key": "vlan",
-                    "value": variables[0]
-                },
-                {
-                    "key": "name",
-                    "value": hostname
-                },
-                {
-                    "key": "mgmt_ip",
-                    "value": variables[1]
-                },
-                {
-                    "key": "vlan_ip",
-                    "value": variables[2]
-                }
-            ]
-        }
-    }  # [vlan, mgmt_ip, vlan_ip]
-
-    response = requests.request("POST", url=base_url + endpoint, headers=headers, json=body, verify=False)
-    return response.json()
-
-
-def claim_device_pnp(base_url, token, deviceid, hostname, template_id, image_id=None):
-    endpoint = "/api/v1/onboarding/pnp-device/claim"
-
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
-
-    body = {
-        "populateInventory": True,
-        "deviceClaimList": [
-            {
-                "deviceId": deviceid,
-                "configList": [
-                    {
-                        "configParameters": [],
-                        "configId": template_id,
-                        "saveToStartup": True
-                    }
-                ],
-                "hostname": hostname
-            }
-        ],
-        "imageId": image_id,
-        "removeInactive": False,
-        "configId": template_id  # "bdaec676-5448-4b36-94c2-0145d129635a"
-    }
-
-    response = requests.request("POST", url=base_url + endpoint, headers=headers, json=body, verify=False)
-    return response.json()
-
-
-def get_device_id(base_url, token):
-    endpoint = "/dna/intent/api/v1/onboarding/pnp-device"
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
-
-    response = requests.request("GET", url=base_url + endpoint, headers=headers, verify=False)
-    return response.json()
-
-
-def get_sites(base_url, token):
-    endpoint = "/dna/intent/api/v1/site"
-
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
-
-    response = requests.request("GET", url=base_url + endpoint, headers=headers, verify=False)
-    return response.json()["response"]
-
-
-def sn_to_id(device_ids):
-    dev_sn_to_id = {}
-
-    for dev in device_ids:
-        # print(dev["deviceInfo"]['serialNumber'], dev["id"])
-        dev_sn_to_id[dev["deviceInfo"]['serialNumber']] = dev["id"]
-
-    return dev_sn_to_id
-
-
-def list_of_sites(data):
-    site_dict = {}
-    for i, site in enumerate(data):
-
-        if site["additionalInfo"]:
-            for lookup in site["additionalInfo"]:
-                if lookup["attributes"].get("type") and (
-                        lookup["attributes"].get("type") == "building" or lookup["attributes"].get("type") == "floor"):
-                    site_dict[site["siteNameHierarchy"]] = site["id"]
-
-    return list(site_dict.items())
-
-
 def site_selection_menu(site_list):
     selected_site = {}
     print("************ List of sites ************")
@@ -218,55 +95,66 @@ def site_selection_menu(site_list):
     return selected_site
 
 
-def get_device_list_ready_to_claim(base_url, token):
-    headers = {
-        'x-auth-token': token,
-        'Accept': 'application/json'
-    }
-
-    endpoint = "/api/v1/onboarding/pnp-device?state=Unclaimed%2CPlanned&offset=0&limit=1000"
-
-    response = requests.request("GET", url=base_url + endpoint, headers=headers, verify=False)
-    return response.json()
-
-
 def main():
-    base_url = "https://10.8.6.56"
-    username = "admin"
-    password = getpass.getpass("Enter DNAC password: ")
-    unc_dev_list = []
+    args = vars(arg_parser.parse_args())
+    cache = InventoryCache()
+    env = {
+        "base_url": "https://10.8.6.56",
+        "username": "admin",
+        "password": getpass.getpass("Enter DNAC password: ")
+    }
 
     # 1. Read SN list from CSV
     dev_dict = read_sn_csv("device_list.csv")
 
     # 2. Get DNAC Auth Token
-    token = get_auth_token(base_url, username, password)
+    env['token'] = get_auth_token(env)
 
-    # 3. Get Device ID ready to be claimed
-    unclaimed_devs = get_device_list_ready_to_claim(base_url, token)
+    # 3. PnP devices indexed by serial number and state, sites indexed by hierarchy and the credentials, read in
+    # parallel and kept for the rest of the run
+    pnp_index, site_index, credential_ids = prefetch(env, args["refresh"])
 
-    # 4. create SN to ID mapping
-    sn_to_id_dict = sn_to_id(unclaimed_devs)
+    # 4. Check everything up front. Serial numbers from the CSV that are ready to be claimed, and for those the site
+    # to claim them to: a building or floor given by its full hierarchy, e.g. Global/SJC/SJ11, or its id
+    ready = pnp_index.select(state=["Unclaimed", "Planned"], serial=list(dev_dict[0]))
+    intersection = {sn for sn in dev_dict[0] if pnp_index.uuid_for("serial", sn) in ready}
 
-    for dev in unclaimed_devs:
-        unc_dev_list.append(dev.get('deviceInfo').get('serialNumber'))
+    failed_devices=[]
+    unknown_sites = []
+    claims = []
+    for sn, hostname in dev_dict[0].items():
+        if sn not in intersection:
+            failed_devices.append(sn)
+            continue
+
+        site_id = site_index.resolve(dev_dict[1][sn][3], types=("building", "floor"))
+        if site_id is None:
+            unknown_sites.append(sn)
+            continue
 
-    intersection = list(set(unc_dev_list) & set(list(dev_dict[0].keys())))
+        claims.append((sn, pnp_index.uuid_for("serial", sn), hostname,
+                       dev_dict[1][sn][:3] + [site_id])) # [vlan, mgmt_ip, vlan_ip, site]
 
-    print("List of Devices ready to be claimed", len(intersection), "out of", len(dev_dict[0]), "provided.")
-    for valid_sn in intersection:
+    print("List of Devices ready to be claimed", len(claims), "out of", len(dev_dict[0]), "provided.")
+    for valid_sn, *_ in claims:
         print(valid_sn)
 
     print()
 
-    # 5. Get sites
-    raw_sites = get_sites(base_url, token)
+    for sn in unknown_sites:
+        print(sn, dev_dict[0][sn], "can't be claimed, site", dev_dict[1][sn][3], "is not a building or floor in DNAC")
+
+    if not credential_ids:
+        print("Warning: no CLI or SNMPv3 global credentials found in DNAC.")
+
+    if not claims:
+        print("Nothing to claim. Goodbye..")
+        return
 
-    site_list = list_of_sites(raw_sites)
     print()
     while True:
    
-        choice=input(f"Do you want to proceed with claiming these {len(intersection)} devices ? y/n: "  )
+        choice=input(f"Do you want to proceed with claiming these {len(claims)} devices ? y/n: "  )
         if choice.lower() == "y":
             print("Starting claiming process...")
             break
@@ -276,19 +164,20 @@ def main():
         else:
             print("Try again by inputing y/n...")
 
-    # 6. Start Discovery
-    failed_devices=[]
-    for sn, hostname in dev_dict[0].items():
-        if sn in intersection:
-            for site in site_list:
-                if dev_dict[1][sn][3] in site:
-                    dev_dict[1][sn][3]=site[1]
-            print("Claiming", hostname, sn,)
-            claim_site_pnp(base_url, token, sn_to_id_dict[sn], hostname, dev_dict[1][sn]) # [vlan, mgmt_ip, vlan_ip, site]
-            print()
+    # 5. Start Discovery. Claims run from a worker pool paced by the client's governor, transient errors are retried.
+    results = site_claim_devices(env, claims)
 
-        else:
-            failed_devices.append(sn)
+    cache.invalidate(env, "pnp_devices")
+
+    claim_errors = {sn: result for sn, result in results.items() if result["status"] != "SUCCESS"}
+    print()
+    print(f"Claimed {len(results) - len(claim_errors)} of {len(results)} devices.")
+
+    if claim_errors:
+        print("Devices listed below failed to claim..")
+        for sn, result in claim_errors.items():
+            print(sn, result["hostname"], result["message"])
+        print()
 
     print("Devices listed below can't be claimed becuase they are not in the Catalyst Center PnP portal yet..")
 
@@ -296,7 +185,32 @@ def main():
        print(sn)
     print()
 
-    print("Done, Monitor claimed devices in Catalyst center PnP Dashboard for progress!")
+    claimed = {result["deviceId"]: sn for sn, result in results.items() if result["status"] == "SUCCESS"}
+    if args["no_track"] or not claimed:
+        print("Done, Monitor claimed devices in Catalyst center PnP Dashboard for progress!")
+        return
+
+    # 6. Follow every claimed device until it is Provisioned or in Error, timing each state it goes through
+    print(f"Following {len(claimed)} claimed devices until they are provisioned..")
+    tracker = OnboardingTracker(env, claimed, timeout=args["track_timeout"] * 60)
+
+    for device_id, old_state, new_state in tracker.wait():
+        print()
+        print(claimed[device_id], dev_dict[0][claimed[device_id]], old_state, "->", new_state,
+              tracker.time_in_state(device_id))
+
+    print()
+    for device_id in tracker.stuck:
+        print("Stuck:", claimed[device_id], dev_dict[0][claimed[device_id]], "in", tracker.state(device_id),
+              tracker.time_in_state(device_id))
+
+    print()
+    print("Onboarding time in seconds (min/percentiles/max):")
+    for stage, summary in tracker.latency_distribution().items():
+        print(f" {stage}: {summary}")
+
+    print()
+    print("Done!")
 
 
 if __name__ == "__main__":
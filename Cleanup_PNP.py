@@ -3,110 +3,22 @@ __credits__ = ["Saurabh & Alexios"]
 __email__ = "saushar2@cisco.com"
 __version__ = "1.0"
 
+import argparse
 import getpass
-import time
-import requests
-import urllib3
+from dnac import get_auth_token, deploy_template, delete_device
+from inventory_cache import InventoryCache
+from task_poller import DEPLOYMENT_RUNNING, DeploymentPoller
 
-urllib3.disable_warnings()
+RESET_TEMPLATE_ID = "cb2ff904-054d-4288-afc4-fbd66f0504ea"
 
-
-def get_auth_token(env):
-    url = f'{env["base_url"]}/dna/system/api/v1/auth/token'
-    auth_headers = {
-        "Content-Type": "application/json"
-    }
-
-    # Make the POST Request
-    try:
-        response = requests.request("POST", url, auth=(env['username'], env['password']), headers=auth_headers,
-                                    verify=False)
-        print(response.status_code)
-
-        if response.status_code == requests.codes.ok:
-            token = response.json()["Token"]
-            return token
-
-    except:
-        print("Issue with credentials!")
-
-
-def deploy_template(env, template_id, devices):
-    url = f"{env['base_url']}/dna/intent/api/v1/template-programmer/template/deploy"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
-
-    # devices = json.loads(get_Devices_By_Platform(env))
-    payload = {
-        "forcePushTemplate": True,
-        "targetInfo": devices,  # within this variable we can pass up to 100 devices to be provisioned in one job
-        "templateId": template_id
-    }
-
-    # Make POST request
-    response = requests.post(url, headers=headers, json=payload, verify=False)
-
-    deploy_id = response.json().get('deploymentId').split()[-1]
-
-    return deploy_id
-
-
-def delete_device(env, devices):
-    url = f"{env['base_url']}/api/v1/inventory/delete/bulk"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
-
-    response = requests.delete(url, headers=headers, json=devices, verify=False)
-
-    return
-
-
-# Get list of all DNAC inventory
-def get_network_devices(env):
-    offset = 1
-    limit = 500  # Do NOT exceed 500 as the limit (Per DNAC documentation)
-    device_list = []
-
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env['token']
-    }
-
-    try:
-        while True:
-            # Make the GET Request
-            url = f"{env['base_url']}/dna/intent/api/v1/network-device?offset={offset}&limit={limit}"
-            response = requests.request("GET", url, headers=headers, verify=False)
-
-            if response.status_code == 401:
-                token = get_auth_token(env)
-                offset -= limit
-                headers = {
-                    "content-type": "application/json",
-                    "Accept": "application/json",
-                    "x-auth-token": token
-                }
-                response = requests.request("GET", url, headers=headers, verify=False)  # remake request that failed
-
-            if response.json()['response'] and response.status_code != 401:
-                device_list.extend(response.json()['response'])
-                offset += limit
-            else:
-                break
-
-        return device_list  # return the list of dnac devices
-
-    except Exception as e:
-        print(e)
-        return
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument("--refresh", action="store_true", help="Ignore the cached inventory and re-read it from DNAC")
+arg_parser.add_argument("--delete-chunk", default=50, type=int, help="Most devices removed per bulk delete call")
 
 
 def main():
+    args = vars(arg_parser.parse_args())
+    cache = InventoryCache()
     env = {}
     # get Auth token and save in environment variable
     env["base_url"] = "https://10.8.6.56"  # input("DNAC URL eg https://dnac.example.com:  ")
@@ -114,7 +26,7 @@ def main():
     env["password"] = getpass.getpass()
     env['token'] = get_auth_token(env)
 
-    device_list = get_network_devices(env)
+    device_list = list(cache.network_devices(env, refresh=args["refresh"], fields=("hostname", "serialNumber", "id")))
     reset_list = []
     delete_list = []
 
@@ -134,10 +46,7 @@ def main():
     print("Select devices to reset e.g 1,3,7. Type all to reset all devices.")
     selection = input("Enter choice(s): ")
 
-    if "all" in selection.split(","):
-        deploy_template(env, "cb2ff904-054d-4288-afc4-fbd66f0504ea", reset_list)
-
-    else:
+    if "all" not in selection.split(","):
         reset_list = []
         delete_list = []
 
@@ -154,18 +63,56 @@ def main():
                 }
             )
 
-        deploy_template(env, "cb2ff904-054d-4288-afc4-fbd66f0504ea", reset_list)
-
-    print()
-    for i in range(1, 10):
-        print("Resetting pnp on devices. Please wait" + "." * i, end='\r', flush=True)
-        time.sleep(9)
+    # Deploy the reset template, fewer than 100 devices per deployment, and keep the deployment IDs to follow them
+    poller = DeploymentPoller(env)
+    for i in range(0, len(reset_list), 99):
+        deployment_id = deploy_template(env, RESET_TEMPLATE_ID, reset_list[i:i + 99])
+        print("Reset deployment ID:", deployment_id)
+        poller.add(deployment_id)
     print()
+
+    # DELETE DEVICES. Each device is deleted from inventory as soon as its own reset finishes, in bulk calls of at
+    # most --delete-chunk devices, instead of waiting a fixed time for all of them.
+    pending = {device["instanceUuid"]: device for device in delete_list}
+    failed = []
+    deleted = 0
+
+    print("Resetting pnp on devices and deleting them from inventory as they finish.")
+    for deployment_id, changes, finished in poller.wait():
+        ready = []
+
+        for device in changes:
+            if device.get("deviceId") not in pending or device.get("status") in DEPLOYMENT_RUNNING:
+                continue
+
+            entry = pending.pop(device["deviceId"])
+            if device.get("status") == "SUCCESS":
+                ready.append(entry)
+            else:
+                failed.append([device.get("name"), device.get("status"), device.get("detailedStatusMessage")])
+
+        for i in range(0, len(ready), args["delete_chunk"]):
+            chunk = ready[i:i + args["delete_chunk"]]
+            status_code = delete_device(env, chunk)
+
+            if status_code < 300:
+                deleted += len(chunk)
+            else:
+                failed.extend([[entry["instanceUuid"], "DELETE FAILED", status_code] for entry in chunk])
+
+    cache.invalidate(env, "network_devices")
+
     print()
+    print(f"Deleted {deleted} of {len(delete_list)} devices from inventory.")
 
-    # DELETE DEVICES
-    print("Deleting Devices from inventory.")
-    delete_device(env, delete_list)
+    if failed:
+        print("Devices listed below were not deleted..")
+        for device in failed:
+            print(*device)
+
+    for device_id in pending:  # Never reported by the deployment
+        print(device_id, "no reset status reported, not deleted")
+    print()
 
     print("Done!")
 
@@ -15,15 +15,13 @@ import os
 import argparse
 import getpass
 import time
-import requests
-import urllib3
-
-urllib3.disable_warnings()
-
-# Global vars
-username = ""
-password = ""
-token = ""
+from collections import deque
+from dnac import get_auth_token, test_connection, image_activation, get_task_detail, distribute_batch
+from device_index import DeviceIndex
+from flow_control import BatchSizer
+from inventory_cache import InventoryCache
+from swim_journal import SwimJournal
+from task_poller import TaskPoller
 
 # Initialize Arg parser
 arg_parser = argparse.ArgumentParser(prog=__doc__)
@@ -31,17 +29,15 @@ arg_parser = argparse.ArgumentParser(prog=__doc__)
 arg_parser.add_argument(
     "-d",
     "--devices",
-    required=True,
     type=str,
-    help="File with all hostnames. Must be a csv file."
+    help="File with all hostnames. Must be a csv file. Required to distribute unless --resume is given."
 )
 
 arg_parser.add_argument(
     "-i",
     "--image",
-    required=True,
     type=str,
-    help="Image uuid."
+    help="Image uuid. Required unless --resume is given."
 )
 
 arg_parser.add_argument(
@@ -64,193 +60,68 @@ arg_parser.add_argument(
     help="DNAC URL. eg https://www.dnac-example.com"
 )
 
-args = vars(arg_parser.parse_args())
-
-
-# Create a function to get the authorization token
-def get_auth_token(url):
-    global username
-    global password
-
-    if not username or not password:
-        username = input("Enter username:  ")
-        password = getpass.getpass()
-
-    # Concatenate the URL variable with the path to get the token
-    auth_url = url + "/dna/system/api/v1/auth/token"
-
-    # Include the proper content-type field here
-    auth_headers = {
-        "Content-Type": "application/json"
-    }
-
-    try:
-        response = requests.request("POST", auth_url, auth=(username, password), headers=auth_headers, verify=False)
-        print(response.status_code)
-        if response.status_code == 401:
-            for i in range(3):
-                password = getpass.getpass()
-                response = requests.request("POST", auth_url, auth=(username, password), headers=auth_headers,
-                                            verify=False)
-
-                if response.status_code == 200:
-                    break
-
-        if response.status_code == requests.codes.ok:
-            token = response.json()["Token"]
-            with open("token.tk", "w") as t:
-                t.write(response.json()["Token"])
-            return token
-
-    except Exception as e:
-        print(e)
-        print("Issue with credentials!")
-
-
-# minimal API call to test validity of a DNAC token
-def test_connection(base_url):
-    url = base_url + "/dna/intent/api/v1/diagnostics/system/health"
-
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
-    }
-
-    response = requests.request("GET", url, headers=headers, verify=False)
-
-    return response.status_code
-
-
-# Get list of all DNAC inventory
-def get_network_devices(base_url):
-    global token
-    offset = 1
-    limit = 500  # Do NOT exceed 500 as the limit (Per DNAC documentation)
-    device_list = []
-
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
-    }
-
-    try:
-        while True:
-            # Make the GET Request
-            url = f"{base_url}/dna/intent/api/v1/network-device?offset={offset}&limit={limit}"
-            response = requests.request("GET", url, headers=headers, verify=False)
-
-            if response.status_code == 401:
-                token = get_auth_token(base_url)
-                offset -= limit
-                headers = {
-                    "content-type": "application/json",
-                    "Accept": "application/json",
-                    "x-auth-token": token
-                }
-                response = requests.request("GET", url, headers=headers, verify=False)  # remake request that failed
-
-            if response.json()['response'] and response.status_code != 401:
-                device_list.extend(response.json()['response'])
-                offset += limit
-            else:
-                break
-
-        return device_list  # return the list of dnac devices
-
-    except Exception as e:
-        print(e)
-        return
-
-
-# Distribute images to devices
-def image_distribution(base_url, uuid_list, image_id, batch_size):
-    # Do Not set batch size to greater than 40 or performance will significantly drop on DNAC. Better to keep at ~20.
-    global token
-    body = []
-    batches = []
-    task_id_list = []
-    url = base_url + "/dna/intent/api/v1/image/distribution"
-
-    # Define the headers
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
-    }
+arg_parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="Ignore the cached inventory and re-read it from DNAC"
+)
 
-    for i, dev_id in enumerate(uuid_list, 1):  # start from 1
-        # Build body with batch of devices that distribution is being executed on.
-        body.append({
-            "deviceUuid": dev_id,
-            "imageUuid": image_id
-        })
-
-        if i % batch_size == 0:  # if we hit batch size start new batch.
-            batches.append(body)
-            body = []
-
-    if body:
-        batches.append(body)
-
-    for batch in batches:
-        response = requests.post(url, headers=headers, json=batch, verify=False)
-
-        if response.status_code == 401:
-            token = get_auth_token(base_url)
-            headers = {
-                "content-type": "application/json",
-                "Accept": "application/json",
-                "x-auth-token": token
-            }
-            response = requests.post(url, headers=headers, json=batch, verify=False)
-            task_id_list.append(response.json()["response"]["taskId"])
+arg_parser.add_argument(
+    "--pipeline",
+    action="store_true",
+    help="Activate each distribution batch as soon as it finishes instead of waiting for every batch. "
+         "Implies --distribute and --activate"
+)
 
-        else:
-            task_id_list.append(response.json()["response"]["taskId"])
+arg_parser.add_argument(
+    "--batch-size",
+    default=30,
+    type=int,
+    help="Devices per distribution request. Do not go above 40"
+)
 
-    return task_id_list
+arg_parser.add_argument(
+    "--adaptive-batch",
+    action="store_true",
+    help="Size each distribution batch from observed controller latency and task times (AIMD)"
+)
 
+arg_parser.add_argument(
+    "--max-batch-size",
+    default=40,
+    type=int,
+    help="Ceiling for --adaptive-batch"
+)
 
-# Activate image on any given device
-def image_activation(base_url, uuid_list, image_id):
-    global token
-    task_list = []
+arg_parser.add_argument(
+    "--max-in-flight",
+    default=0,
+    type=int,
+    help="Max distribution tasks running at once, 0 for no limit (5 with --adaptive-batch)"
+)
 
-    url = base_url + "/dna/intent/api/v1/image/activation/device"
+arg_parser.add_argument(
+    "--activation-rate",
+    default=2.5,
+    type=float,
+    help="Max activation requests per second, 0 for no limit"
+)
 
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
-    }
+arg_parser.add_argument(
+    "--activation-burst",
+    default=5,
+    type=int,
+    help="Activation requests allowed back to back before --activation-rate applies"
+)
 
-    for dev_id in uuid_list:
-        body = [{
-            "activateLowerImageVersion": True,
-            "deviceUuid": dev_id,
-            "imageUuidList": [image_id]
-        }]
-
-        try:
-            response = requests.post(url, headers=headers, json=body, verify=False)
-            if response.status_code == 401:
-                token = get_auth_token(base_url)
-                headers = {
-                    "content-type": "application/json",
-                    "Accept": "application/json",
-                    "x-auth-token": token
-                }
-                response = requests.post(url, headers=headers, json=body, verify=False)
-
-            task_list.append(response.json()["response"]["taskId"])
-            time.sleep(0.4)  # add small delay to prevent overwhelming DNAC
-
-        except:
-            continue
+arg_parser.add_argument(
+    "--resume",
+    metavar="JOB_ID",
+    type=str,
+    help="Continue an interrupted job from its journal, skipping devices that already finished"
+)
 
-    return task_list
+args = vars(arg_parser.parse_args())
 
 
 # Load inventory of devices from a given csv
@@ -261,17 +132,10 @@ def get_devices_from_csv(file):
     return devs
 
 
-# Create a list of UUIDs given a list of grouped hostnames (model group) and a dict that has uuid info for every device.
-def group_by_model_uuid(host_list, all_devs_dict):
-    uuid_list = []
-    for hostname in host_list:
-        try:
-            uuid_list.append(all_devs_dict[hostname])
-
-        except:
-            continue
-
-    return uuid_list
+# Create a list of UUIDs given a list of grouped hostnames (model group) and the index of every device. Returns
+# (uuids, hostnames not in the index).
+def group_by_model_uuid(host_list, device_index):
+    return device_index.uuids_for_hostnames(host_list)
 
 
 # Returns 2 lists; list of hostnames and list of uuids of failed devices.
@@ -288,103 +152,145 @@ def get_failed_devices(results):
     return failed_hostnames, failed_uuids
 
 
-# Gets task details given a task id.
-def get_task_detail(base_url, task_id):
-    global token
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
+# Distribute images in batches sized by sizer, with at most max_in_flight distribution tasks running at once (no
+# limit when 0). Each new batch is sized from how the controller handled the previous ones. With activate=True each
+# batch is activated as soon as its own distribution finishes, failed devices pruned, while other batches are still
+# distributing. activate_now are devices that are already distributed and only need activating.
+#
+# Every task submitted and finished goes to the journal so the job can be resumed. On resume, the tasks the previous
+# run left running are passed in distribution_tasks ({task id: uuids}) and activation_tasks ({task id: uuids}) and
+# are polled again instead of being resubmitted.
+def run_swim(env, uuid_list, image_id, sizer, max_in_flight=0, activate=False, activate_now=(), journal=None,
+             distribution_tasks=None, activation_tasks=None):
+    waiting = deque(uuid_list)
+    batches = {}  # distribution task id -> (uuids in that batch, time submitted or None when re-attached)
+    activations = {}  # activation task id -> uuids
+    failed = set()
+    report = {
+        "distributed": {"Success": 0, "Failure": 0, "Total": 0},
+        "activated": {"Success": 0, "Failure": 0, "Total": 0},
+        "failed_hostnames": [],
+        "failed_activations": []
     }
+    poller = TaskPoller(env)
+
+    def submit_batches():
+        while waiting and (not max_in_flight or len(batches) < max_in_flight):
+            batch = [waiting.popleft() for _ in range(min(sizer.size, len(waiting)))]
+            started = time.time()
+            task = distribute_batch(env, batch, image_id)
+            sizer.record_latency(time.time() - started)
+
+            batches[task] = (batch, started)
+            poller.add(task)
+            if journal:
+                journal.submitted("distribution", task, batch)
+            print(f" Distribution task {task} started for {len(batch)} devices.")
+
+    def submit_activations(devices):
+        if not devices:
+            return
+
+        tasks, refused = image_activation(env, devices, image_id)
+        print(f" Activation requested for {len(tasks)} devices, {len(refused)} refused.")
+        report["failed_activations"].extend([[dev_id, error] for dev_id, error in refused.items()])
+
+        for dev_id, task in tasks.items():
+            activations[task] = [dev_id]
+            poller.add(task)
+            if journal:
+                journal.submitted("activation", task, [dev_id])
+
+        if journal and refused:  # Refused requests never got a task, record them as finished and failed
+            journal.finished("activation", None, [], refused)
+
+    for task, batch in (distribution_tasks or {}).items():
+        batches[task] = (batch, None)  # Real submit time unknown, keep it out of the batch sizing
+        poller.add(task)
+
+    for task, devices in (activation_tasks or {}).items():
+        activations[task] = devices
+        poller.add(task)
+
+    submit_batches()
+    submit_activations(list(activate_now))
+
+    for task, result in poller.wait():
+        if task in poller.failed:
+            # DNAC says the task doesn't exist, so how its devices did is unknown. Nothing goes to the journal, the
+            # task stays outstanding there and --resume checks on it again.
+            distribution = task in batches
+            devices = batches.pop(task)[0] if distribution else activations.pop(task)
+            failed |= set(devices)
+            report["failed_hostnames" if distribution else "failed_activations"].extend(
+                [[dev_id, f"{result['Error']}, left for --resume"] for dev_id in devices])
+            print(f" Gave up on task {task} for {len(devices)} devices: {result['Error']}.")
+
+            if distribution:
+                submit_batches()
+            continue
 
-    response = requests.get(f"{base_url}/api/v1/image/task?taskUuid={task_id}",
-                            headers=headers, verify=False)
-
-    if response.status_code == 401:
-        token = get_auth_token(base_url)
-        headers = {
-            "content-type": "application/json",
-            "Accept": "application/json",
-            "x-auth-token": token
-        }
-        response = requests.get(f"{base_url}/api/v1/image/task?taskUuid={task_id}", headers=headers, verify=False)
-
-    return response.json()["response"]
-
-
-# Gets a task overall summary given the task id.
-def get_overall_task_status(base_url, task_id):
-    global token
-    block = u'\u2588'
-    progress = 0
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": token
-    }
+        if task in batches:
+            batch, started = batches.pop(task)
+            batch_failed = {}  # uuid -> reason
 
-    while True:
-        response = requests.get(f"{base_url}/dna/intent/api/v1/task/{task_id}",
-                                headers=headers, verify=False)
-
-        if response.status_code == 401:
-            token = get_auth_token(base_url)
-            headers = {
-                "content-type": "application/json",
-                "Accept": "application/json",
-                "x-auth-token": token
-            }
-            response = requests.get(f"{base_url}/dna/intent/api/v1/task/{task_id}",
-                                    headers=headers, verify=False)
-
-        if response.json()["response"]["progress"] == "Starting Distribution":
-            if progress == 0:
-                print(" Starting Distribution..")
-
-            progress += 1
-            print(f"\r {response.json()['response']['data']} in progress:{block * progress}", end='', flush=True)
-
-            if progress == 20:
-                progress = 0
-            #print(f" Still Waiting for {response.json()['response']['data']} of images to finish. Please wait..")
-            time.sleep(20)
-            continue
+            for key in report["distributed"]:
+                report["distributed"][key] += result[key]
 
-        elif response.json()["response"]["progress"] == "image activation":
-            print(" Starting Image Activation..")
-            time.sleep(30)
-            continue
+            if result.get("Error"):  # Whole batch failed before DNAC reported per device status
+                batch_failed = {dev_id: result["Error"] for dev_id in batch}
+                report["failed_hostnames"].extend([[dev_id, result["Error"]] for dev_id in batch])
+
+            elif result["Failure"] > 0:
+                print(" Failed devices found, getting details.")
+                fail_list = get_failed_devices(get_task_detail(env, task))
+                report["failed_hostnames"].extend(fail_list[0])
+                batch_failed = {dev_id: status for dev_id, (_, status) in zip(fail_list[1], fail_list[0])}
+
+            failed |= set(batch_failed)
+            if started is not None:
+                sizer.record_task(time.time() - started, len(batch), len(batch_failed))
+
+            ready = [dev_id for dev_id in batch if dev_id not in batch_failed]
+            if journal:
+                journal.finished("distribution", task, ready, batch_failed)
+
+            if activate:
+                submit_activations(ready)
+
+            submit_batches()
 
-        task = response.json()["response"]["progress"].split(',')
-
-        success = int(task[0].split('=')[-1])
-        failure = int(task[1].split('=')[-1])
-        running = int(task[2].split('=')[-1])
-        pending = int(task[3].split('=')[-1])
-        total = int(task[-1].split('=')[-1])
-
-        if running == 0 and pending == 0:
-            result_dict = {"Success": success, "Failure": failure, "Running": running, "Pending": pending,
-                           "Total": total}
-            # print(f" Finished {response.json()['response']['data']} job.")
-            # print(" Success:", success)
-            # print(" Failure:", failure)
-            # print(" Running:", running)
-            # print(" Pending:", pending)
-            # print(" Total:", total)
-            # print()
-            break
         else:
-            progress += 1
-            print(f"\r {response.json()['response']['data']} in progress:{block * progress}", end='', flush=True)
+            devices = activations.pop(task)
+            activation_failed = {}
+
+            for key in report["activated"]:
+                report["activated"][key] += result[key]
+
+            if result.get("Error"):
+                activation_failed = {dev_id: result["Error"] for dev_id in devices}
+                report["failed_activations"].extend([[dev_id, result["Error"]] for dev_id in devices])
+
+            elif result["Failure"] > 0:
+                fail_act = get_failed_devices(get_task_detail(env, task))
+                report["failed_activations"].append(fail_act[0][0])
+                activation_failed = {dev_id: status for dev_id, (_, status) in zip(fail_act[1], fail_act[0])}
+
+            if journal:
+                journal.finished("activation", task, [dev_id for dev_id in devices if dev_id not in activation_failed],
+                                 activation_failed)
 
-            if progress == 20:
-                progress = 0
-            #print(f" Still Waiting for {response.json()['response']['data']} of images to finish. Please wait..")
-            time.sleep(20)
+    report["ready"] = [dev_id for dev_id in uuid_list if dev_id not in failed]
 
+    return report
+
+
+def print_status(name, counts):
+    print(f" Status of image {name}.")
+    print(" Successful Devices:", counts["Success"])
+    print(" Failed Devices:", counts["Failure"])
+    print(" Total Devices:", counts["Total"])
     print()
-    return result_dict
 
 
 # Write to a csv file.
@@ -407,19 +313,35 @@ def write_to_csv(dev_list, log_dir, file_name, header, nested=False):
 
 # Defines the workflow of the application.
 def main():
-    global username
-    global password
-    global token
-
     url = args["url"]
-    model_list = []
-    all_dev_dict = {}
+    # Activation pacing goes to the client's request governor: (max in flight, requests/sec, burst)
+    env = {"base_url": url, "limits": {"activation": (8, args["activation_rate"], args["activation_burst"])}}
+    device_index = DeviceIndex()
     image_id = args["image"]
     current_timestamp = time.strftime('%m-%d-%Y-%H_%M_%S')  # USA Date Format
     log_dir = "DNAC_SWIM"
     uuid_list = []
-    failed_uuids = []
-    failed_hostnames = []
+    journal = SwimJournal(log_dir, args["resume"])
+    state = None
+
+    if args["resume"]:
+        if not journal.exists():
+            print(f"No journal found for job {args['resume']} in {log_dir}/SWIM_Jobs.")
+            print()
+            return
+
+        # Image, devices and steps all come from the journal so the job carries on exactly as it was started.
+        state = journal.load()
+        image_id = state.image_id
+        args["distribute"], args["activate"], args["pipeline"] = state.distribute, state.activate, state.pipeline
+
+    elif not image_id or ((args["distribute"] or args["pipeline"]) and not args["devices"]):
+        print("An image (-i) and, to distribute, a device csv (-d) are required unless resuming with --resume.")
+        print()
+        return
+
+    if args["pipeline"]:  # Pipelining is distribution and activation interleaved
+        args["distribute"] = args["activate"] = True
 
     if not args["distribute"] and not args["activate"]:
         print("You have not selected whether you want the script to distribute, activate or carry out both tasks.")
@@ -429,100 +351,120 @@ def main():
     # 1) Get DNAC x-auth-token
     print("1. Getting DNAC Token.")
 
+    # Credentials are collected up front so the token can be renewed during a long job without stopping on a prompt.
+    env["username"] = input("Enter username:  ")
+    env["password"] = getpass.getpass()
+
     if os.path.exists("token.tk"):
         with open("token.tk", "r") as t:
-            token = t.read()
+            env["token"] = t.read()
+        env["token_issued_at"] = os.path.getmtime("token.tk")
 
-        #print(token)
-        status_code = test_connection(url)
+        status_code = test_connection(env)
         if status_code == 401:
-            # username = input("Enter username:  ")
-            # password = getpass.getpass()
-            token = get_auth_token(url)
+            env["token"] = get_auth_token(env)
+            env.pop("token_issued_at", None)
 
     else:
-        token = get_auth_token(url)
+        env["token"] = get_auth_token(env)
 
-    if not token:
+    if not env["token"]:
         print("Could not get token. Goodbye..")
         exit(1)
 
-    if args["distribute"]:
-        # 2) Get All network devices in DNAC
-        print(f"2. Getting all devices in DNAC.")
-        all_network_devices = get_network_devices(url)
-
-        # 3) Get all network device types
-        print("3. Getting all network device types/models in inventory.")
-        for device in all_network_devices:
-            if device["type"] not in model_list:
-                model_list.append(device["type"])
-
-        print(" Global device list:", model_list)
+    if "token_issued_at" not in env:  # Only rewrite the file for a new token, its mtime tells the next run its age
+        with open("token.tk", "w") as t:
+            t.write(env["token"])
 
-        # 4) Get hostname list from CSV
-        print("4. Getting device hostnames from CSV.")
-        hostname_list = get_devices_from_csv(args["devices"])
+    print(f" Job ID: {journal.job_id}. If the run is interrupted, continue it with --resume {journal.job_id}")
 
-        # print(" Hostnames: ", hostname_list[1:])
-
-        # 5) Create global device dict where we will use to map the hostname of a device to its UUID.
-        print("5. Creating Dictionary mapping for hostnames to uuids for all devices.")
-
-        for device in all_network_devices:
-            all_dev_dict[device["hostname"]] = device["id"]
-        # print("Hostname to uuid mappings", all_dev_dict)
+    if args["distribute"]:
+        if state:
+            # 2-6) Devices come from the journal. Tasks the last run left running are polled again, not resubmitted.
+            uuid_list = state.pending_distribution()
+            print(f"2-6. Resuming job {journal.job_id}: {len(uuid_list)} devices left to distribute, "
+                  f"{len(state.outstanding['distribution'])} distribution tasks to check on.")
 
-        # 6) Group the device uuids from the specific site by their model and by a filter applied to the hostname.
-        print("6. Comparing hostname list to all device dictionary to pull uuids only for our specified hostnames.")
-        uuid_list = group_by_model_uuid(hostname_list[1:], all_dev_dict)
+        else:
+            # 2) Stream all network devices in DNAC from the local inventory cache (refreshed when past its TTL or
+            # with --refresh). Only the fields we need are kept so memory stays flat however large the inventory is.
+            print(f"2. Getting all devices in DNAC.")
+            print("3. Getting all network device types/models in inventory.")
+            print("4. Indexing hostnames to uuids for all devices.")
+
+            cache = InventoryCache()
+            for device in cache.network_devices(env, refresh=args["refresh"], fields=("hostname", "id", "type")):
+                # 3 & 4) Index every device by hostname, uuid and type. The type index is the list of models.
+                device_index.add(device)
+
+            print(" Global device list:", device_index.values("type"))
+
+            # 5) Get hostname list from CSV
+            print("5. Getting device hostnames from CSV.")
+            hostname_list = get_devices_from_csv(args["devices"])
+
+            # 6) Group the device uuids from the specific site by their model and by a filter applied to the hostname.
+            print("6. Comparing hostname list to all device dictionary to pull uuids only for our specified hostnames.")
+            uuid_list, missing = group_by_model_uuid(hostname_list[1:], device_index)
+
+            if missing and not args["refresh"]:  # Devices added since the cache was filled, read DNAC again once
+                print(f" {len(missing)} hostnames not in the cached inventory, refreshing it from DNAC.")
+                device_index = DeviceIndex(cache.network_devices(env, refresh=True, fields=("hostname", "id", "type")))
+                uuid_list, missing = group_by_model_uuid(hostname_list[1:], device_index)
+
+            if missing:
+                print(f" {len(missing)} hostnames are not in DNAC and will be skipped:", missing)
+            journal.start(image_id, uuid_list, args["distribute"], args["activate"], args["pipeline"])
+
+        # Fixed batches unless --adaptive-batch, in which case the size moves between 5 and --max-batch-size.
+        if args["adaptive_batch"]:
+            sizer = BatchSizer(initial=min(20, args["max_batch_size"]), ceiling=args["max_batch_size"])
+            max_in_flight = args["max_in_flight"] or 5
+        else:
+            sizer = BatchSizer.fixed(args["batch_size"])
+            max_in_flight = args["max_in_flight"]
+
+        if args["pipeline"]:
+            # 7-10) Distribute and activate batch by batch
+            print("7. Distributing images, each batch is activated as soon as its distribution finishes.")
+            report = run_swim(env, uuid_list, image_id, sizer, max_in_flight, activate=True,
+                              activate_now=state.pending_activation() if state else (), journal=journal,
+                              distribution_tasks=state.outstanding["distribution"] if state else None,
+                              activation_tasks=state.outstanding["activation"] if state else None)
+
+            if report["failed_hostnames"]:
+                write_to_csv(report["failed_hostnames"], log_dir, "Failed_Distributions_" + current_timestamp,
+                             header="Failed Devices")
+            if report["failed_activations"]:
+                write_to_csv(report["failed_activations"], log_dir, "Failed_Activations_" + current_timestamp,
+                             header="Failed Activations")
+
+            print_status("distribution", report["distributed"])
+            print_status("activation", report["activated"])
+            print("Done! Check /DNAC_SWIM/SWIM_Jobs/ directory for reporting.")
+            print()
+            return
 
         # 7) Distribute Images to devices
+        # 8) Validate state of image push job. All distribution tasks are polled together and each result is
+        # handled as soon as its task finishes.
+        # 9) See if there are any failures on any devices
         print("7. Distributing images to devices.")
-
-        # 30 devices per API call
-        task_info = image_distribution(url, uuid_list, image_id, batch_size=30)
-        print()
-        print(" Task information: ", task_info)
-        print()
-
-        # 8) Validate state of image push job
         print("8. Getting Overall result. This will take a while, you may want to grab some coffee..")
+        report = run_swim(env, uuid_list, image_id, sizer, max_in_flight, journal=journal,
+                          distribution_tasks=state.outstanding["distribution"] if state else None)
 
-        # Keep count of success, fail and total distributions.
-        success = 0
-        failure = 0
-        total = 0
-
-        for x, task in enumerate(task_info):
-            # result = {"Success": 3, "Failure": 1, "Running": 0, "Pending": 0, "Total": 4}
-            result = get_overall_task_status(url, task)
-            success += result["Success"]
-            failure += result["Failure"]
-            total += result["Total"]
-
-            # 9) See if there are any failures on any devices
-            if x == 0:
-                print("9. Getting details on failed devices.")
-
-            if result["Failure"] > 0:
-                print(" Failed devices found, getting details.")
-                failed = get_task_detail(url, task)  # return response object
-                fail_list = get_failed_devices(failed)
-                failed_uuids.extend(fail_list[1])
-                failed_hostnames.extend(fail_list[0])
+        if report["failed_hostnames"]:
+            # Failed devices are removed from the list of uuids to be activated later on
+            write_to_csv(report["failed_hostnames"], log_dir, "Failed_Distributions_" + current_timestamp,
+                         header="Failed Devices")
 
-        if failed_uuids:
-            for failed_id in failed_uuids:  # Remove failed devices from list of uuids to be activated later on
-                uuid_list.remove(failed_id)
-            write_to_csv(failed_hostnames, log_dir, "Failed_Distributions_" + current_timestamp, header="Failed Devices")
+        # Everything distributed and not yet activated, including devices an earlier run of this job distributed.
+        state = journal.load()
+        uuid_list = state.pending_activation()
 
         print()
-        print(" Status of image distribution.")
-        print(" Successful Devices:", success)
-        print(" Failed Devices:", failure)
-        print(" Total Devices:", total)
-        print()
+        print_status("distribution", report["distributed"])
 
         print(uuid_list)
         # Write to fileuuids of devices that are ready to be activated
@@ -530,45 +472,28 @@ def main():
         print()
 
     # 10) Activate images on devices
-    failed_activations = []
     if args["activate"]:
         if args["distribute"]:
             print("10. Activating Images")
         else:
             print("2. Activating Images")
-        if not uuid_list:  # If uuid list does not exist in RAM then read from csv file.
+
+        if state is None:  # Activation only job, read the devices from the csv the distribution run left.
             uuid_list = get_devices_from_csv(log_dir+"/SWIM_Jobs/UUIDS_to_Activate.csv")
             uuid_list.remove("Device UUIDs")  # Remove header from CSV.
+            journal.start(image_id, uuid_list, False, True, False)
+            state = journal.load()
 
-        task_list = image_activation(url, uuid_list, image_id)
-        print(" Activation task ids: ", task_list)
-
-        # Keep tally count of success, fail and total activations.
-        success = 0
-        failure = 0
-        total = 0
-
-        for task in task_list:
-            activation_task_result = get_overall_task_status(url, task)
-            success += activation_task_result["Success"]
-            failure += activation_task_result["Failure"]
-            total += activation_task_result["Total"]
-
-            if activation_task_result["Failure"] > 0:
-                failed_act = get_task_detail(url, task)
-                fail_act = get_failed_devices(failed_act)
-                failed_activations.append(fail_act[0][0])
-
-                #failed_uuids = failed_act[1]  # Figure out if you want these for later on
-
-        if failed_activations:
-            write_to_csv(failed_activations, log_dir, "Failed_Activations_"+current_timestamp, header="Failed Activations")
-    
-        print(" Status of image activation.")
-        print(" Successful Devices:", success)
-        print(" Failed Devices:", failure)
-        print(" Total Devices:", total)
-        print()
+        # Activation requests go out for devices not activated yet and activation tasks from an interrupted run
+        # are polled again. Results are tallied as each task finishes.
+        report = run_swim(env, [], image_id, None, activate=True, activate_now=state.pending_activation(),
+                          journal=journal, activation_tasks=state.outstanding["activation"])
+
+        if report["failed_activations"]:
+            write_to_csv(report["failed_activations"], log_dir, "Failed_Activations_"+current_timestamp,
+                         header="Failed Activations")
+
+        print_status("activation", report["activated"])
 
     print()
     print("Done! Check /DNAC_SWIM/SWIM_Jobs/ directory for reporting.")
@@ -0,0 +1,152 @@
+__author__ = "Alexios Nersessian"
+__copyright__ = "Copyright 2023, Cisco"
+__email__ = "anersess@cisco.com"
+__version__ = "v3"
+__coauthor__ = "Saurabh Sharma"
+
+"""
+Script watches template deployments recorded by DNACtemplatepush in ./deployids/. Every deployment ID in the given
+files is polled concurrently, device status changes are printed as they happen and a summary is given at the end.
+
+usage example:  python DNACdeploywatch.py -u "https://www.dnac-example.com" deployids/deploy_ids_06-01-2023_job_1001.csv
+                python DNACdeploywatch.py -u "https://www.dnac-example.com" --report watch_report.csv
+"""
+
+import argparse
+import csv
+import getpass
+import glob
+import os
+import time
+from dnac import get_auth_token, test_connection
+from task_poller import DeploymentPoller
+
+# Initialize Arg parser
+arg_parser = argparse.ArgumentParser(prog=__doc__)
+
+arg_parser.add_argument(
+    "files",
+    nargs="*",
+    help="Deploy ID csv files or glob patterns. Defaults to every file in ./deployids/"
+)
+
+arg_parser.add_argument(
+    "-u",
+    "--url",
+    required=True,
+    type=str,
+    help="DNAC URL. eg https://www.dnac-example.com"
+)
+
+arg_parser.add_argument(
+    "--report",
+    type=str,
+    help="Write the final status of every device to this csv file"
+)
+
+arg_parser.add_argument(
+    "--max-interval",
+    default=60,
+    type=int,
+    help="Longest wait in seconds between polls of one deployment"
+)
+
+args = vars(arg_parser.parse_args())
+
+
+# Deployment IDs from deploy_ids csv files, in file order without duplicates.
+def get_deployment_ids(patterns):
+    deployment_ids = {}
+
+    for pattern in patterns:
+        for file in sorted(glob.glob(pattern)):
+            with open(file, "r", newline='') as f:
+                for row in csv.reader(f):
+                    if row and row[0].strip():
+                        deployment_ids[row[0].strip()] = file
+
+    return deployment_ids
+
+
+def main():
+    env = {"base_url": args["url"]}
+    patterns = args["files"] or ["./deployids/deploy_ids_*.csv"]
+
+    deployment_ids = get_deployment_ids(patterns)
+    if not deployment_ids:
+        print("No deployment IDs found in", ", ".join(patterns))
+        return
+
+    print(f"1. Watching {len(deployment_ids)} deployments.")
+
+    # Credentials are collected up front so the token can be renewed while deployments are watched.
+    env["username"] = input("Enter username:  ")
+    env["password"] = getpass.getpass()
+
+    if os.path.exists("token.tk"):
+        with open("token.tk", "r") as t:
+            env["token"] = t.read()
+        env["token_issued_at"] = os.path.getmtime("token.tk")
+
+        if test_connection(env) == 401:
+            env["token"] = get_auth_token(env)
+            env.pop("token_issued_at", None)
+
+    else:
+        env["token"] = get_auth_token(env)
+
+    if not env["token"]:
+        print("Could not get token. Goodbye..")
+        exit(1)
+
+    # 2) Poll every deployment together, each on its own adaptive interval, and print devices as they change.
+    print("2. Polling deployments.")
+    start = time.time()
+    poller = DeploymentPoller(env, deployment_ids, maximum=args["max_interval"])
+
+    for deployment_id, changes, finished in poller.wait(show_progress=False):
+        for device in changes:
+            message = device.get("detailedStatusMessage") or ""
+            print(f" {time.strftime('%H:%M:%S')} {deployment_id} {device.get('name')}: {device.get('status')} "
+                  f"{message}")
+
+        if finished and deployment_id in poller.failed:
+            print(f" {time.strftime('%H:%M:%S')} {deployment_id} could not be read, giving up on it.")
+        elif finished:
+            print(f" {time.strftime('%H:%M:%S')} {deployment_id} finished.")
+
+    # 3) Summary per deployment and overall
+    print()
+    print(f"3. All deployments finished in {round(time.time() - start, 1)}s.")
+    totals = {}
+    rows = []
+
+    for deployment_id, file in deployment_ids.items():
+        counts = {}
+
+        for device in poller.results(deployment_id):
+            counts[device.get("status")] = counts.get(device.get("status"), 0) + 1
+            rows.append([file, deployment_id, device.get("deviceId"), device.get("name"), device.get("status"),
+                         device.get("detailedStatusMessage")])
+
+        for status, count in counts.items():
+            totals[status] = totals.get(status, 0) + count
+
+        print(f" {deployment_id}: {counts or 'status unavailable'}")
+
+    print()
+    print(" Total devices per status:", totals)
+
+    if args["report"]:
+        with open(args["report"], "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["File", "Deployment ID", "Device ID", "Hostname", "Status", "Message"])
+            writer.writerows(rows)
+
+        print(" Report written to", args["report"])
+
+    print()
+
+
+if __name__ == '__main__':
+    main()
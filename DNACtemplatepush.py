@@ -4,10 +4,15 @@ __email__ = "anersess@cisco.com"
 __version__ = "v3"
 __coauthor__ = "Saurabh Sharma"
 
+import argparse
 import csv
 import getpass
 import os
 from dnac import *
+from device_index import DeviceIndex, TARGET_INFO_KEYS
+from inventory_cache import InventoryCache
+from template_catalog import TemplateCatalog
+from template_deployer import deploy_template_groups, summarize
 
 ######################################
 class bcolors:
@@ -24,6 +29,12 @@ class bcolors:
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--refresh", action="store_true", help="Ignore the cached tags and templates and re-read them from DNAC")
+    arg_parser.add_argument("--max-in-flight", default=4, type=int,
+                            help="Template deployments running at once, 0 for no limit")
+    args = vars(arg_parser.parse_args())
+
     env = {}
     # get Auth token and save in environment variable
     env["base_url"] = "https://10.8.6.56"  #input("DNAC URL eg https://dnac.example.com:  ")
@@ -32,7 +43,10 @@ if __name__ == "__main__":
     env['token'] = get_auth_token(env)
 
     group_size = 99  # group size must be below 100.
-    tags = get_device_tags(env)
+    cache = InventoryCache()
+    tags = list(cache.tags(env, refresh=args["refresh"]))
+    # Fetched once (or served from the cache) and indexed, every prompt below is answered from it
+    catalog = TemplateCatalog(cache.templates(env, refresh=args["refresh"]))
     tagDict = {}
     taglist = []
     count = 0
@@ -56,7 +70,8 @@ if __name__ == "__main__":
             selectTag = int(input(f"{bcolors.OKGREEN}Select a tag number 0 to {countTags - 1}:  {bcolors.ENDC}"))
             yeorne = input(f"{bcolors.WARNING}Are you sure? y/n {taglist[selectTag]} {bcolors.ENDC}:  ")
             if yeorne == 'y':
-                dnacDevs = get_devices_by_tag(env, tagDict[taglist[selectTag]])
+                # Index the tag members by uuid so a device is only targeted once
+                dnacDevs = list(DeviceIndex(get_devices_by_tag(env, tagDict[taglist[selectTag]]), keys=TARGET_INFO_KEYS))
                 break
 
         except:
@@ -67,7 +82,7 @@ if __name__ == "__main__":
     print()
 
     # Select project
-    project = get_project_names(env) #  Get the project names from DNAC
+    project = catalog.projects()  # Project names from the template catalog
     index = ''
     select_project = ''
     count_proj = 0
@@ -94,10 +109,10 @@ if __name__ == "__main__":
     # Select Project
     x = 0
     if select_project != '':
-        template = get_template_id(env, select_project)  # Get template ID
+        template = catalog.templates_in(select_project)  # (name, template ID) pairs
 
-        for i in range(0, len(template), 2):
-            print(x, template[i], "Template ID:", template[i + 1])
+        for name, template_id in template:
+            print(x, name, "Template ID:", template_id)
             x += 1
 
     print()
@@ -107,22 +122,13 @@ if __name__ == "__main__":
         print()
         try:
             selection = int(input(f"{bcolors.OKGREEN}Please Select a template to deploy 0-{x - 1}:  {bcolors.ENDC}"))
-            convertSelection = selection + selection + 1  # Convert to proper index in list to pull correct ID
+            template_name, template_id = template[selection]
             yeorne = input(
-                f"Are you sure you want to deploy {bcolors.WARNING}{template[convertSelection - 1]}{bcolors.ENDC}? y or n, -1 to quit:  ")
+                f"Are you sure you want to deploy {bcolors.WARNING}{template_name}{bcolors.ENDC}? y or n, -1 to quit:  ")
 
             if yeorne == "y":
 
-                groups = [dnacDevs[x:x + group_size] for x in
-                          range(0, len(dnacDevs),
-                                group_size)]  # Pythonic way (list slicing) to break down list to groups of X devices
-
-                for i in range(len(groups)):
-                    #print(groups[i])
-                    deploy.append([deploy_template(env, template[convertSelection],
-                                                   groups[i])])  # Template ID is the second parameter
-
-                if deploy: #Check for empty list
+                if dnacDevs: #Check for empty list
                     try:
                         with open('jobid.id', 'r') as read:
                             jobId = int(read.readline())
@@ -141,13 +147,38 @@ if __name__ == "__main__":
                     print()
                     print("Deploy ID file: ", f'deploy_ids_{date}_job_{bcolors.WARNING}{strId}{bcolors.ENDC}.csv')
 
-                ids = f'./deployids/deploy_ids_{date}_job_{strId}.csv'  # CSV to store deploy IDs
-                # Write Deployment ID(s) to file
-                with open(ids, 'a', newline='') as csvfile:
-                    # creating a csv writer object
-                    csvwriter = csv.writer(csvfile)
-                    # writing the data rows
-                    csvwriter.writerows(deploy)
+                    ids = f'./deployids/deploy_ids_{date}_job_{strId}.csv'  # CSV to store deploy IDs
+
+                    # Write each Deployment ID to file as soon as DNAC accepts it, so an interrupted run can still
+                    # be checked on later
+                    def record_deployment(deployment_id):
+                        deploy.append([deployment_id])
+                        with open(ids, 'a', newline='') as csvfile:
+                            csv.writer(csvfile).writerow([deployment_id])
+
+                    # Groups of group_size devices are deployed concurrently, at most max_in_flight at a time, and
+                    # every deployment is polled until each device has finished
+                    start = time.time()
+                    results, group_times = deploy_template_groups(env, template_id, dnacDevs, group_size,
+                                                                  args["max_in_flight"], on_submit=record_deployment)
+
+                    print()
+                    for group in group_times:
+                        print(f"Group {group['group']}: {group['devices']} devices, deployment "
+                              f"{group['deploymentId']}, {group['seconds']}s {group['error'] or ''}")
+
+                    # Per device result of the whole push
+                    with open(f'./deployids/deploy_results_{date}_job_{strId}.csv', 'w', newline='') as csvfile:
+                        csvwriter = csv.writer(csvfile)
+                        csvwriter.writerow(["Device ID", "Hostname", "Group", "Deployment ID", "Status", "Message"])
+                        for device_id, row in results.items():
+                            csvwriter.writerow([device_id, row["hostname"], row["group"], row["deploymentId"],
+                                                row["status"], row["message"]])
+
+                    print()
+                    print(f"{bcolors.OKGREEN}Deployed to {len(results)} devices in "
+                          f"{round(time.time() - start, 1)}s: {summarize(results)}{bcolors.ENDC}")
+                    print("Device results file: ", f'deploy_results_{date}_job_{strId}.csv')
 
                 # print(template[convertSelection])
                 break
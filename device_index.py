@@ -0,0 +1,126 @@
+# Hash indexes over a device list so selecting and pruning devices is a dict/set lookup instead of a list scan.
+#
+# usage example:
+#   index = DeviceIndex(cache.network_devices(env))
+#   c9300 = index.select(type="Cisco Catalyst 9300 Switch", site="Global/SJC/SJ11")
+#   to_activate = index.select(hostname=hostname_list, exclude=failed_uuids)
+
+
+# Index name -> function pulling that value out of a record. Each record shape DNAC hands back gets its own map.
+NETWORK_DEVICE_KEYS = {
+    "uuid": lambda record: record.get("id"),
+    "hostname": lambda record: record.get("hostname"),
+    "serial": lambda record: record.get("serialNumber"),
+    "platformId": lambda record: record.get("platformId"),
+    "type": lambda record: record.get("type"),
+    "site": lambda record: record.get("siteNameHierarchy") or record.get("location")
+}
+
+PNP_DEVICE_KEYS = {
+    "uuid": lambda record: record.get("id"),
+    "hostname": lambda record: record.get("deviceInfo", {}).get("hostname"),
+    "serial": lambda record: record.get("deviceInfo", {}).get("serialNumber"),
+    "platformId": lambda record: record.get("deviceInfo", {}).get("pid"),
+    "type": lambda record: record.get("deviceInfo", {}).get("family"),
+    "site": lambda record: record.get("deviceInfo", {}).get("siteName"),
+    "state": lambda record: record.get("deviceInfo", {}).get("state")
+}
+
+# targetInfo entries as returned by dnac.get_devices_by_tag
+TARGET_INFO_KEYS = {
+    "uuid": lambda record: record.get("id"),
+    "hostname": lambda record: record.get("hostName")
+}
+
+
+class DeviceIndex:
+    def __init__(self, records=(), keys=None):
+        self.keys = keys or NETWORK_DEVICE_KEYS
+        self.devices = {}  # uuid -> record, in insertion order
+        self.indexes = {name: {} for name in self.keys if name != "uuid"}  # name -> value -> set of uuids
+
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, uuid):
+        return uuid in self.devices
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def add(self, record):
+        uuid = self.keys["uuid"](record)
+
+        if uuid in self.devices:
+            self.remove(uuid)
+
+        self.devices[uuid] = record
+
+        for name, index in self.indexes.items():
+            value = self.keys[name](record)
+            if value is not None:
+                index.setdefault(value, set()).add(uuid)
+
+    def remove(self, uuid):
+        record = self.devices.pop(uuid, None)
+
+        if record is None:
+            return
+
+        for name, index in self.indexes.items():
+            members = index.get(self.keys[name](record))
+            if members is not None:
+                members.discard(uuid)
+                if not members:
+                    del index[self.keys[name](record)]
+
+    def get(self, uuid):
+        return self.devices.get(uuid)
+
+    # Set of uuids whose `name` value is value (or any of the values when a list/set is given).
+    def by(self, name, value):
+        values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+        if name == "uuid":
+            return {uuid for uuid in values if uuid in self.devices}
+
+        index = self.indexes[name]
+        return set().union(*[index.get(item, ()) for item in values])
+
+    # All distinct values seen for an index, e.g. values("type") is every model in the inventory.
+    def values(self, name):
+        return list(self.indexes[name])
+
+    # Uuids matching every criterion (e.g. type=..., site=[...]), minus anything in exclude.
+    def select(self, exclude=(), **criteria):
+        selected = None
+
+        for name, value in criteria.items():
+            matches = self.by(name, value)
+            selected = matches if selected is None else selected & matches
+
+        if selected is None:
+            selected = set(self.devices)
+
+        return selected - set(exclude)
+
+    # Uuid for one hostname/serial, or None. Hostnames and serials are unique in DNAC.
+    def uuid_for(self, name, value):
+        return next(iter(self.indexes[name].get(value, ())), None)
+
+    # Map hostnames to uuids keeping the caller's order. Returns (uuids, hostnames not in the index).
+    def uuids_for_hostnames(self, hostnames):
+        uuids = []
+        missing = []
+
+        for hostname in hostnames:
+            uuid = self.uuid_for("hostname", hostname)
+            if uuid is None:
+                missing.append(hostname)
+            else:
+                uuids.append(uuid)
+
+        return uuids, missing
@@ -1,26 +1,171 @@
 # Alex Nersessian 3/30/22
 import getpass
+import threading
 import time
 import requests
 import urllib3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from flow_control import RequestGovernor
 urllib3.disable_warnings()
 
 
+TOKEN_LIFETIME = 60 * 60  # DNAC tokens are valid for 60 minutes
+TOKEN_RENEW_BEFORE = 5 * 60  # Renew this long before the token lapses
+
+
+# Owns the DNAC token for one env. Renews it before it lapses using the stored credentials and never prompts, so a
+# long job can't stall on getpass. Concurrent callers share a single renewal: whoever takes the lock first gets the
+# new token and the others pick it up instead of calling /auth/token again.
+class TokenManager:
+    def __init__(self, env, lifetime=TOKEN_LIFETIME, renew_before=TOKEN_RENEW_BEFORE):
+        self.env = env
+        self.lifetime = lifetime
+        self.renew_before = renew_before
+        self.lock = threading.Lock()
+        self.current = None
+        self.issued_at = 0
+
+    # Pick up a token the caller put in env (e.g. from get_auth_token or token.tk). env['token_issued_at'] gives its
+    # age when known, otherwise it's treated as new.
+    def _adopt(self):
+        if self.env.get("token") != self.current:
+            self.current = self.env.get("token")
+            self.issued_at = self.env.pop("token_issued_at", time.time())
+
+    # Current token, renewed first if it's missing or about to lapse.
+    def token(self):
+        with self.lock:
+            self._adopt()
+            due = not self.current or time.time() - self.issued_at > self.lifetime - self.renew_before
+
+        if due:
+            return self.refresh(self.current)
+
+        return self.current
+
+    # Renew the token unless someone already replaced stale_token. Returns the token to use, or None.
+    def refresh(self, stale_token=None):
+        with self.lock:
+            self._adopt()
+
+            if self.current and self.current != stale_token:
+                return self.current
+
+            token = request_token(self.env)
+
+            if token:
+                self.env["token"] = token
+                self.env["token_issued_at"] = time.time()
+                self._adopt()
+
+            return token
+
+
+# Shared keep-alive connection to DNAC. Every API call goes through one requests.Session so a long job reuses a few
+# warm TLS connections from the pool instead of doing a handshake per request.
+class DNACClient:
+    def __init__(self, env, pool_size=20, limits=None):
+        self.env = env
+        self.base_url = env["base_url"]
+        self.tokens = TokenManager(env)
+        self.governor = RequestGovernor(limits)
+        self.session = requests.Session()
+        self.session.verify = False
+
+        # Size the pool for the number of requests we may have in flight at once against this one host.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        })
+
+    def _send(self, method, url, token, kwargs):
+        headers = {**kwargs.pop("headers", {}), "x-auth-token": token or ""}
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        url = path if path.startswith("http") else self.base_url + path
+
+        with self.governor.slot(url):  # Wait for this endpoint class to have room
+            token = self.tokens.token()
+            response = self._send(method, url, token, dict(kwargs))
+
+            if response.status_code == 401:  # Token was revoked early, renew it and remake the request that failed
+                token = self.tokens.refresh(token)
+                if token:
+                    response = self._send(method, url, token, dict(kwargs))
+
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# Return the client stored in env, creating it on first use so every function shares the same connection pool.
+def get_client(env):
+    client = env.get("client")
+
+    if client is None or client.base_url != env["base_url"]:
+        client = DNACClient(env, pool_size=env.get("pool_size", 20), limits=env.get("limits"))
+        env["client"] = client
+
+    return client
+
+
+# Ask DNAC for a token with the credentials already in env. Never prompts; returns None if DNAC says no.
+def request_token(env):
+    url = f'{env["base_url"]}/dna/system/api/v1/auth/token'
+
+    try:
+        response = get_client(env).session.post(url, auth=(env['username'], env['password']),
+                                                headers={"Content-Type": "application/json"})
+
+        if response.status_code == requests.codes.ok:
+            return response.json()["Token"]
+
+        print(f"Token renewal failed: {response.status_code}")
+
+    except Exception as e:
+        print(e)
+        print("Issue with credentials!")
+
+
+# Interactive login used when a script starts. Prompts for anything missing and retries the password on a 401.
 def get_auth_token(env):
     url = f'{env["base_url"]}/dna/system/api/v1/auth/token'
     auth_headers = {
         "Content-Type": "application/json"
     }
 
+    if not env.get("username"):
+        env["username"] = input("Enter username:  ")
+    if not env.get("password"):
+        env["password"] = getpass.getpass()
+
+    session = get_client(env).session
+
     # Make the POST Request
     try:
-        response = requests.request("POST", url, auth=(env['username'], env['password']), headers=auth_headers, verify=False)
+        response = session.post(url, auth=(env['username'], env['password']), headers=auth_headers)
         print(response.status_code)
         if response.status_code == 401:
             for i in range(3):
-                password = getpass.getpass()
-                response = requests.request("POST", url, auth=(env['username'], password), headers=auth_headers,
-                                            verify=False)
+                env["password"] = getpass.getpass()
+                response = session.post(url, auth=(env['username'], env['password']), headers=auth_headers)
 
                 if response.status_code == 200:
                     break
@@ -33,78 +178,47 @@ def get_auth_token(env):
         print("Issue with credentials!")
 
 
-def get_device_info_by_id(env, dev_id):
-    url = f'{env["base_url"]}/dna/intent/api/v1/network-device/{dev_id}/'
+# minimal API call to test validity of a DNAC token
+def test_connection(env):
+    response = get_client(env).session.get(f'{env["base_url"]}/dna/intent/api/v1/diagnostics/system/health',
+                                           headers={"x-auth-token": env.get("token") or ""})
 
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-    response = requests.request("GET", url, headers=headers, verify=False)
+    return response.status_code
 
-    return response.json()
 
+def get_device_info_by_id(env, dev_id):
+    response = get_client(env).get(f'/dna/intent/api/v1/network-device/{dev_id}/')
 
-def create_tag(env, name):
-    url = f'{env["base_url"]}/dna/intent/api/v1/tag'
+    return response.json()
 
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
 
+def create_tag(env, name):
     payload = {"name": name}
 
-    response = requests.request("POST", url, headers=headers, json=payload, verify=False)
+    response = get_client(env).post('/dna/intent/api/v1/tag', json=payload)
 
     return response.status_code
 
 
 def tag_add_member(env, tag_id, members):
-    url = f'{env["base_url"]}/dna/intent/api/v1/tag/{tag_id}/member'
-    #print(tagId)
-    #print()
-    #print(members)
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
     payload = {"networkdevice": members}
 
-    response = requests.request("POST", url, headers=headers, json=payload, verify=False)
+    response = get_client(env).post(f'/dna/intent/api/v1/tag/{tag_id}/member', json=payload)
 
     return response.status_code
 
 
 def get_tag_id(env, name):
-    url = f'{env["base_url"]}/dna/intent/api/v1/tag'
-
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-
     params = {'name': name}
 
-    response = requests.request("GET", url, headers=headers, params=params, verify=False)
+    response = get_client(env).get('/dna/intent/api/v1/tag', params=params)
 
     return response.json()['response'][0]['id']
 
 
 def get_device_tags(env):
-    url = f'{env["base_url"]}/dna/intent/api/v1/tag'
-
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
     tags = []
-    response = requests.request("GET", url, headers=headers, verify=False)
+    response = get_client(env).get('/dna/intent/api/v1/tag')
 
     for item in response.json()['response']:
         tags.append(item)
@@ -113,17 +227,8 @@ def get_device_tags(env):
 
 
 def get_devices_by_tag(env, tag_id):
-    url = f'{env["base_url"]}/dna/intent/api/v1/tag/{tag_id}/member?memberType=networkdevice'
     dev_list = []
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
-    devices = []
-    response = requests.request("GET", url, headers=headers, verify=False)
-    for item in response.json()['response']:
-        devices.append(item)
+    response = get_client(env).get(f'/dna/intent/api/v1/tag/{tag_id}/member?memberType=networkdevice')
 
     for item in response.json()['response']:
         dev_list.append({'hostName': item['hostname'], 'type': 'MANAGED_DEVICE_UUID',
@@ -133,16 +238,10 @@ def get_devices_by_tag(env, tag_id):
 
 
 def get_devices_by_platform(env, platform_Id):
-    url = f'{env["base_url"]}/dna/intent/api/v1/network-device'
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
     dev_list = []
     query_string_params = platform_Id  # GET Target Devices from env file
-    response = requests.get(url, headers=headers,
-                            params=query_string_params, verify=False)
+    response = get_client(env).get('/dna/intent/api/v1/network-device', params=query_string_params)
+
     for item in response.json()['response']:
         dev_list.append({'hostName': item['hostname'], 'type': 'MANAGED_DEVICE_UUID',
                         'id': item['id']})  # structure the list to the format of targetInfo
@@ -150,110 +249,166 @@ def get_devices_by_platform(env, platform_Id):
     return dev_list
 
 
-# Get list of all DNAC inventory
-def get_network_devices(env):
-    offset = 1
-    limit = 500  # Do NOT exceed 500 as the limit (Per DNAC documentation)
-    device_list = []
-
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env['token']
-    }
+# Number of devices in DNAC inventory
+def get_network_device_count(env):
+    response = get_client(env).get("/dna/intent/api/v1/network-device/count")
+
+    return response.json()["response"]
+
+
+# Yield records from a paged DNAC endpoint as each page arrives, so callers never hold the whole result set.
+# fields keeps only those keys of every record. When the total is known, up to `parallel` pages are fetched ahead
+# of the consumer and still yielded in order. Paging stops at the first short page.
+def paginate(env, path, params=None, limit=500, offset=1, fields=None, total=None, parallel=1):
+    client = get_client(env)
+    params = dict(params or {})
+
+    def get_page(page_offset):
+        body = client.get(path, params={**params, "offset": page_offset, "limit": limit}).json()
+        return body if isinstance(body, list) else body["response"]  # PnP endpoints return a bare list
+
+    def project(page):
+        if not fields:
+            return page
+        return [{key: record.get(key) for key in fields} for record in page]
+
+    page = []
+
+    if total:
+        offsets = range(offset, offset + total, limit)
+        offset += len(offsets) * limit
+
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            window = deque()
+
+            for page_offset in offsets:
+                window.append(executor.submit(get_page, page_offset))
+
+                if len(window) >= parallel:  # Keep at most `parallel` pages in memory
+                    page = window.popleft().result()
+                    yield from project(page)
+
+            while window:
+                page = window.popleft().result()
+                yield from project(page)
+
+        if len(page) < limit:
+            return
+
+    # Walk the rest one page at a time. Also picks up records added after the total was taken.
+    while True:
+        page = get_page(offset)
+        yield from project(page)
+
+        if len(page) < limit:
+            break
 
+        offset += limit
+
+
+# Stream DNAC inventory one record at a time. Page offsets come from the device count so pages are fetched
+# concurrently, at most `parallel` at a time.
+def iter_network_devices(env, fields=None, parallel=8):
     try:
-        while True:
-            # Make the GET Request
-            url = f"{env['base_url']}/dna/intent/api/v1/network-device?offset={offset}&limit={limit}"
-            response = requests.request("GET", url, headers=headers, verify=False)
-
-            if response.status_code == 401:
-                token = get_auth_token(env)
-                offset -= limit
-                headers = {
-                    "content-type": "application/json",
-                    "Accept": "application/json",
-                    "x-auth-token": token
-                }
-                response = requests.request("GET", url, headers=headers, verify=False)  # remake request that failed
+        total = get_network_device_count(env)
+    except Exception:
+        total = 0  # Count not available, fall back to walking the pages one at a time
 
-            if response.json()['response'] and response.status_code != 401:
-                device_list.extend(response.json()['response'])
-                offset += limit
-            else:
-                break
+    # Do NOT exceed 500 as the limit (Per DNAC documentation)
+    yield from paginate(env, "/dna/intent/api/v1/network-device", limit=500, fields=fields, total=total,
+                        parallel=parallel)
 
-        return device_list  # return the list of dnac devices
+
+# Get list of all DNAC inventory
+def get_network_devices(env, parallel=8):
+    try:
+        return list(iter_network_devices(env, parallel=parallel))  # return the list of dnac devices
 
     except Exception as e:
         print(e)
         return
 
 
+# Map hostnames to device uuids in bulk. Hostnames are looked up `chunk` at a time with network-device's multi value
+# hostname filter, or from one pull of the whole inventory when there are more than `inventory_threshold` of them.
+# Only hostnames still unresolved fall back to device-detail, which is heavy on DNAC, with those lookups run `workers`
+# at a time. Returns {hostname: uuid}, with None for every hostname DNAC does not know.
+def resolve_device_ids(env, hostnames, chunk=40, workers=8, inventory_threshold=1000):
+    client = get_client(env)
+    wanted = set(hostnames)
+    found = {}
+
+    def by_filter(names):
+        try:
+            return [(device["hostname"], device["id"])
+                    for device in paginate(env, "/dna/intent/api/v1/network-device", params={"hostname": names},
+                                           fields=("hostname", "id"))]
+        except Exception:
+            return []  # Leave this chunk's hostnames to the device-detail fallback
+
+    def by_detail(hostname):
+        try:
+            response = client.get('/dna/intent/api/v1/device-detail',
+                                  params={'searchBy': hostname, 'identifier': 'nwDeviceName'})
+            return response.json()['response'].get("nwDeviceId")
+        except Exception:
+            return None
+
+    if len(wanted) > inventory_threshold:
+        for device in iter_network_devices(env, fields=("hostname", "id")):
+            if device["hostname"] in wanted:
+                found[device["hostname"]] = device["id"]
+
+    else:
+        names = list(wanted)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for matches in executor.map(by_filter, [names[i:i + chunk] for i in range(0, len(names), chunk)]):
+                # The filter matches patterns, keep exact hits only
+                found.update((hostname, uuid) for hostname, uuid in matches if hostname in wanted)
+
+    misses = [hostname for hostname in wanted if hostname not in found]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for hostname, uuid in zip(misses, executor.map(by_detail, misses)):
+            found[hostname] = uuid
+
+    return {hostname: found[hostname] for hostname in hostnames}
+
+
+# Device uuids for rows of hostnames (first column), in the same order. None where the hostname is not in DNAC.
 def get_device_id(env, name):
-    dev_list = []
-    url = f'{env["base_url"]}/dna/intent/api/v1/device-detail'
-    headers = {
-        'x-auth-token': env['token'],
-        'Content-Type': 'application/json',
-        'Accept': 'application/json'
-    }
+    resolved = resolve_device_ids(env, [device[0] for device in name])
 
-    for device in name:
-        #print(device[0])
-        params = {'searchBy': device[0], 'identifier': 'nwDeviceName'}
-        dev = requests.get(url, headers=headers, params=params, verify=False)
-        #print(dev.json())
-        dev_list.append(dev.json()['response']["nwDeviceId"])
-    #print(dev_list)
-    return dev_list
+    return [resolved[device[0]] for device in name]
 
 
-def get_project_names(env):
-    url = f"{env['base_url']}/dna/intent/api/v1/template-programmer/template"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
+# Every template in the template programmer, one record per template with its committed versions in versionsInfo.
+def get_templates(env):
+    return get_client(env).get("/dna/intent/api/v1/template-programmer/template").json()
+
 
-    response = requests.request("GET", url, headers=headers, verify=False)
+def get_project_names(env):
     project = []
 
-    for line in response.json():
+    for line in get_templates(env):
         if line['projectName'] not in project:
             project.append(line['projectName'])
 
     return project
 
 
+# Flat [name, id, name, id, ...] list of the templates in a project.
 def get_template_id(env, project):
-    url = f"{env['base_url']}/dna/intent/api/v1/template-programmer/template"
     template = []
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
 
-    response = requests.request("GET", url, headers=headers, verify=False)
-
-    # print(json.dumps(response.json(), indent=4))
-    for line in response.json():
-        if project in str(line):  # Get template ID from desired project
-            template.append(dict(line)['name'])
-            template.append(dict(line)['templateId'])
+    for line in get_templates(env):
+        if line['projectName'] == project:  # Get template ID from desired project
+            template.append(line['name'])
+            template.append(line['templateId'])
 
     return template
 
 
 def deploy_template(env, template_id, devices):
-    url = f"{env['base_url']}/dna/intent/api/v1/template-programmer/template/deploy"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
-
-    # devices = json.loads(get_Devices_By_Platform(env))
     payload = {
         "forcePushTemplate": True,
         "targetInfo": devices,  # within this variable we can pass up to 100 devices to be provisioned in one job
@@ -261,7 +416,7 @@ def deploy_template(env, template_id, devices):
     }
 
     # Make POST request
-    response = requests.post(url, headers=headers, json=payload, verify=False)
+    response = get_client(env).post("/dna/intent/api/v1/template-programmer/template/deploy", json=payload)
 
     deploy_id = response.json().get('deploymentId').split()[-1]
 
@@ -269,94 +424,55 @@ def deploy_template(env, template_id, devices):
 
 
 def get_task(env, task_id):
-    url = f"{env['base_url']}/dna/intent/api/v1/task/{task_id}"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
-
     # Make GET request
-    response = requests.get(url, headers=headers, verify=False)
+    response = get_client(env).get(f"/dna/intent/api/v1/task/{task_id}")
 
     return response.json()  # return response with information about specific task
 
 
 # Need a way to check if deployment of template to device was successful
 def check_deployment_status(env, deployment_id):
-    url = f"{env['base_url']}/dna/intent/api/v1/template-programmer/template/deploy/status/{deployment_id}"
-    headers = {
-        "x-auth-token": env["token"],
-        "Content-Type": "application/json",
-    }
-
     # Make GET request
-    response = requests.get(url, headers=headers, verify=False)
-    # pprint.pprint(response.json())
+    response = get_client(env).get(f"/dna/intent/api/v1/template-programmer/template/deploy/status/{deployment_id}")
 
     return response.json()["devices"]  # return the deployment status
 
 
-# Distribute images to devices
-def image_distribution(env, uuid_list, image_id, batch_size):
-    # Do Not set batch size to greater than 40 or performance will significantly drop on DNAC. Better to keep at ~20.
-    body = []
-    batches = []
-    task_id_list = []
-    url = env['base_url'] + "/dna/intent/api/v1/image/distribution"
-
-    # Define the headers
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env["token"]
-    }
+# Remove devices from inventory. devices is a list of {"instanceUuid": ..., "cleanConfig": ...}
+def delete_device(env, devices):
+    response = get_client(env).delete("/api/v1/inventory/delete/bulk", json=devices)
 
-    for i, dev_id in enumerate(uuid_list, 1):  # start from 1
-        # Build body with batch of devices that distribution is being executed on.
-        body.append({
-            "deviceUuid": dev_id,
-            "imageUuid": image_id
-        })
+    return response.status_code
 
-        if i % batch_size == 0:  # if we hit batch size start new batch.
-            batches.append(body)
-            body = []
 
-    if body:
-        batches.append(body)
+# Split a list of device uuids into distribution batches.
+def make_batches(uuid_list, batch_size):
+    return [uuid_list[i:i + batch_size] for i in range(0, len(uuid_list), batch_size)]
 
-    for batch in batches:
-        response = requests.post(url, headers=headers, json=batch, verify=False)
 
-        if response.status_code == 401:
-            token = get_auth_token(env)
-            headers = {
-                "content-type": "application/json",
-                "Accept": "application/json",
-                "x-auth-token": token
-            }
-            response = requests.post(url, headers=headers, json=batch, verify=False)
-            task_id_list.append(response.json()["response"]["taskId"])
+# Start image distribution for one batch of devices and return its task id.
+def distribute_batch(env, batch, image_id):
+    # Build body with batch of devices that distribution is being executed on.
+    body = [{"deviceUuid": dev_id, "imageUuid": image_id} for dev_id in batch]
 
-        else:
-            task_id_list.append(response.json()["response"]["taskId"])
+    response = get_client(env).post("/dna/intent/api/v1/image/distribution", json=body)
 
-    return task_id_list
+    return response.json()["response"]["taskId"]
 
 
-# Activate image on any given device
-def image_activation(env, uuid_list, image_id):
-    task_list = []
+# Distribute images to devices
+def image_distribution(env, uuid_list, image_id, batch_size):
+    # Do Not set batch size to greater than 40 or performance will significantly drop on DNAC. Better to keep at ~20.
+    return [distribute_batch(env, batch, image_id) for batch in make_batches(uuid_list, batch_size)]
 
-    url = env['base_url'] + "/dna/intent/api/v1/image/activation/device"
 
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env["token"]
-    }
+# Activate image on any given device. Requests go out from a pool of `workers` threads. The client's governor paces
+# the activation endpoint (env['limits']['activation'] to change it) to prevent overwhelming DNAC. Returns
+# ({uuid: task id}, {uuid: error}) where the second item has every device whose activation request was refused.
+def image_activation(env, uuid_list, image_id, workers=8):
+    client = get_client(env)
 
-    for dev_id in uuid_list:
+    def activate(dev_id):
         body = [{
             "activateLowerImageVersion": True,
             "deviceUuid": dev_id,
@@ -364,74 +480,151 @@ def image_activation(env, uuid_list, image_id):
         }]
 
         try:
-            response = requests.post(url, headers=headers, json=body, verify=False)
-            if response.status_code == 401:
-                token = get_auth_token(env)
-                headers = {
-                    "content-type": "application/json",
-                    "Accept": "application/json",
-                    "x-auth-token": token
-                }
-                response = requests.post(url, headers=headers, json=body, verify=False)
+            response = client.post("/dna/intent/api/v1/image/activation/device", json=body)
+        except Exception as e:
+            return None, str(e)
+
+        try:
+            return response.json()["response"]["taskId"], None
+        except Exception:
+            return None, f"{response.status_code}: {response.text[:200]}"
+
+    tasks = {}
+    failed = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for dev_id, (task_id, error) in zip(uuid_list, executor.map(activate, uuid_list)):
+            if task_id:
+                tasks[dev_id] = task_id
+            else:
+                failed[dev_id] = error
 
-            task_list.append(response.json()["response"]["taskId"])
-            time.sleep(0.4)  # add small delay to prevent overwhelming DNAC
+    return tasks, failed
 
-        except:
-            continue
 
-    return task_list
+# Stream device health records for a site one record at a time.
+def iter_devices_from_site_id(env, site_id, fields=None):
+    # Do NOT set limit over 1000 as per DNAC documentation.
+    yield from paginate(env, "/dna/intent/api/v1/device-health", params={"siteId": site_id}, limit=1000,
+                        fields=fields)
 
 
 # Get device hostnames with location
 def get_devices_from_site_id(env, site_id, target_model_list):
-    limit = 1000  # Do NOT set over 1000 as per DNAC documentation.
-    offset = 1
-    device_list = []
-    dev_type_list =[]
-    ip_dev_dict = {}
-
-    # Define the new headers
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env['token']
-    }
+    return list(iter_devices_from_site_id(env, site_id))
 
-    while True:
-        url =  f"{env['base_url']}/dna/intent/api/v1/device-health?siteId={site_id}&limit={limit}&offset={offset}"
-        offset += limit
-        # Get the network device JSON
-        response = requests.get(url, headers=headers, verify=False)
 
-        if not response.json()["response"]:
-            break
+# Gets task details given a task id.
+def get_task_detail(env, task_id):
+    response = get_client(env).get(f"/api/v1/image/task?taskUuid={task_id}")
 
-        device_list.extend(response.json()["response"])
+    return response.json()["response"]
 
 
-    return device_list
+# Body for a PnP site claim. variables is [vlan, mgmt_ip, vlan_ip, site_id] as read from the device CSV.
+def site_claim_payload(deviceid, hostname, variables):
+    return {
+        "siteId": variables[3],
+        "deviceId": deviceid,
+        "hostname": hostname,
+        "type": "Default",
+        "imageInfo": {
+            "imageId": "",
+            "skip": False,
+            "removeInactive": True
+        },
+        "configInfo": {
+            "configId": "e1825fc0-655f-464b-bee0-cfda47c87222",
+            "configParameters": [
+                {
+                    "key": "vlan",
+                    "value": variables[0]
+                },
+                {
+                    "key": "name",
+                    "value": hostname
+                },
+                {
+                    "key": "mgmt_ip",
+                    "value": variables[1]
+                },
+                {
+                    "key": "vlan_ip",
+                    "value": variables[2]
+                }
+            ]
+        }
+    }  # [vlan, mgmt_ip, vlan_ip]
+
+
+# One deviceClaimList entry: a device, its hostname and its day-0 template with that device's own parameters.
+def device_claim_entry(deviceid, hostname, template_id, parameters=None):
+    return {
+        "deviceId": deviceid,
+        "configList": [
+            {
+                "configParameters": [{"key": key, "value": value} for key, value in (parameters or {}).items()],
+                "configId": template_id,
+                "saveToStartup": True
+            }
+        ],
+        "hostname": hostname
+    }
 
 
-# Gets task details given a task id.
-def get_task_detail(env, task_id):
-    headers = {
-        "content-type": "application/json",
-        "Accept": "application/json",
-        "x-auth-token": env['token']
+# Body for a PnP claim of every device in entries (device_claim_entry) in one request.
+def bulk_claim_payload(entries, template_id, image_id=None):
+    return {
+        "populateInventory": True,
+        "deviceClaimList": entries,
+        "imageId": image_id,
+        "removeInactive": False,
+        "configId": template_id  # "bdaec676-5448-4b36-94c2-0145d129635a"
     }
 
-    response = requests.get(f"{env['base_url']}/api/v1/image/task?taskUuid={task_id}",
-                            headers=headers, verify=False)
 
-    if response.status_code == 401:
-        token = get_auth_token(env)
-        headers = {
-            "content-type": "application/json",
-            "Accept": "application/json",
-            "x-auth-token": token
-        }
-        response = requests.get(f"{env['base_url']}/api/v1/image/task?taskUuid={task_id}", headers=headers, verify=False)
+# Body for a PnP claim of a single device with a day-0 template.
+def device_claim_payload(deviceid, hostname, template_id, image_id=None):
+    return bulk_claim_payload([device_claim_entry(deviceid, hostname, template_id)], template_id, image_id)
+
+
+def claim_site_pnp(env, deviceid, hostname, variables, template_id=None):
+    body = site_claim_payload(deviceid, hostname, variables)
+
+    response = get_client(env).post("/api/v1/onboarding/pnp-device/site-claim", json=body)
+    return response.json()
+
+
+def claim_device_pnp(env, deviceid, hostname, template_id, image_id=None):
+    body = device_claim_payload(deviceid, hostname, template_id, image_id)
+
+    response = get_client(env).post("/api/v1/onboarding/pnp-device/claim", json=body)
+    return response.json()
+
+
+# Number of PnP devices, only those in the given states (e.g. ["Unclaimed", "Planned"]) when states is set.
+def get_pnp_device_count(env, states=None):
+    params = {"state": ",".join(states)} if states else {}
+    response = get_client(env).get("/dna/intent/api/v1/onboarding/pnp-device/count", params=params)
 
     return response.json()["response"]
 
+
+# Stream PnP devices one record at a time, only those in the given states when states is set. Page offsets come from
+# the device count so pages are fetched concurrently, at most `parallel` at a time. PnP offsets start at 0.
+def iter_pnp_devices(env, states=None, fields=None, parallel=8):
+    params = {"state": ",".join(states)} if states else {}
+
+    try:
+        total = get_pnp_device_count(env, states)
+    except Exception:
+        total = 0  # Count not available, fall back to walking the pages one at a time
+
+    # Do NOT set limit over 1000 as per DNAC documentation.
+    yield from paginate(env, "/dna/intent/api/v1/onboarding/pnp-device", params=params, limit=1000, offset=0,
+                        fields=fields, total=total, parallel=parallel)
+
+
+# Every PnP device waiting to be claimed.
+def get_device_list_ready_to_claim(env):
+    return list(iter_pnp_devices(env, states=["Unclaimed", "Planned"]))
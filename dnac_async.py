@@ -0,0 +1,240 @@
+# Asyncio counterpart of dnac.py. Every function has the same name and arguments as in dnac.py, with an
+# AsyncDNACClient taking the place of env, so large inventories can be fetched and polled with many requests in flight.
+#
+# usage example:
+#   async with AsyncDNACClient(env, pool_size=100, concurrency=100) as client:
+#       devices = await get_network_devices(client)
+#       tasks = await asyncio.gather(*[get_task(client, task_id) for task_id in task_ids])
+import asyncio
+import time
+import aiohttp
+from dnac import site_claim_payload, device_claim_payload, TOKEN_LIFETIME, TOKEN_RENEW_BEFORE
+
+
+class AsyncDNACClient:
+    def __init__(self, env, pool_size=100, concurrency=100):
+        self.env = env
+        self.base_url = env["base_url"]
+        self.pool_size = pool_size
+        self.semaphore = asyncio.Semaphore(concurrency)  # Max requests in flight at any time
+        self.auth_lock = asyncio.Lock()
+        self.issued_at = env.pop("token_issued_at", time.time())
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            # Bounded pool of keep-alive connections to the one controller. DNAC uses a self-signed cert.
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size, ssl=False)
+            self.session = aiohttp.ClientSession(connector=connector, headers={
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            })
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # Get a new token unless another coroutine already replaced the one that failed. Uses the stored credentials only,
+    # it never prompts.
+    async def refresh_token(self, stale_token=None):
+        async with self.auth_lock:
+            if self.env.get("token") and self.env.get("token") != stale_token:
+                return self.env["token"]
+
+            url = f'{self.base_url}/dna/system/api/v1/auth/token'
+            auth = aiohttp.BasicAuth(self.env["username"], self.env["password"])
+
+            async with self.session.post(url, auth=auth) as response:
+                if response.status == 200:
+                    self.env["token"] = (await response.json(content_type=None))["Token"]
+                    self.issued_at = time.time()
+                    return self.env["token"]
+
+            print("Issue with credentials!")
+
+    # Returns (status, json body). A 401 refreshes the token once and remakes the request that failed.
+    async def request(self, method, path, **kwargs):
+        url = path if path.startswith("http") else self.base_url + path
+
+        # Renew before the token lapses rather than waiting for a 401
+        if not self.env.get("token") or time.time() - self.issued_at > TOKEN_LIFETIME - TOKEN_RENEW_BEFORE:
+            await self.refresh_token(self.env.get("token"))
+
+        async with self.semaphore:
+            for attempt in range(2):
+                token = self.env.get("token")
+                async with self.session.request(method, url, headers={"x-auth-token": token or ""},
+                                                **kwargs) as response:
+                    if response.status == 401 and attempt == 0:
+                        await self.refresh_token(token)
+                        continue
+
+                    return response.status, await response.json(content_type=None)
+
+    async def get(self, path, **kwargs):
+        return (await self.request("GET", path, **kwargs))[1]
+
+    async def post(self, path, **kwargs):
+        return (await self.request("POST", path, **kwargs))[1]
+
+    async def delete(self, path, **kwargs):
+        return (await self.request("DELETE", path, **kwargs))[1]
+
+
+# Number of devices in DNAC inventory
+async def get_network_device_count(client):
+    return (await client.get("/dna/intent/api/v1/network-device/count"))["response"]
+
+
+# Get list of all DNAC inventory. Pages are computed from the device count and fetched concurrently, at most
+# `parallel` at a time, then put back together in order.
+async def get_network_devices(client, parallel=8):
+    limit = 500  # Do NOT exceed 500 as the limit (Per DNAC documentation)
+    page_slots = asyncio.Semaphore(max(1, parallel))
+
+    async def get_page(offset):
+        async with page_slots:
+            page = await client.get(f"/dna/intent/api/v1/network-device?offset={offset}&limit={limit}")
+            return page["response"]  # An error body has no response, fail rather than return a short inventory
+
+    try:
+        total = await get_network_device_count(client)
+    except Exception:
+        total = 0  # Count not available, fall back to walking the pages one at a time
+
+    offsets = list(range(1, total + 1, limit))
+    pages = list(await asyncio.gather(*[get_page(offset) for offset in offsets]))
+
+    # Devices added after the count was taken land past the last page, keep going until a short page.
+    offset = 1 + len(offsets) * limit
+    while not pages or len(pages[-1]) == limit:
+        page = await get_page(offset)
+        if not page:
+            break
+        pages.append(page)
+        offset += limit
+
+    return [device for page in pages for device in page]
+
+
+# Get device hostnames with location
+async def get_devices_from_site_id(client, site_id, target_model_list):
+    limit = 1000  # Do NOT set over 1000 as per DNAC documentation.
+    offset = 1
+    device_list = []
+
+    while True:
+        page = await client.get(f"/dna/intent/api/v1/device-health?siteId={site_id}&limit={limit}&offset={offset}")
+        offset += limit
+
+        if not page["response"]:
+            break
+
+        device_list.extend(page["response"])
+
+    return device_list
+
+
+# Distribute images to devices. All batches are posted concurrently, task ids come back in batch order.
+async def image_distribution(client, uuid_list, image_id, batch_size):
+    # Do Not set batch size to greater than 40 or performance will significantly drop on DNAC. Better to keep at ~20.
+    batches = []
+
+    for i in range(0, len(uuid_list), batch_size):
+        batches.append([{"deviceUuid": dev_id, "imageUuid": image_id} for dev_id in uuid_list[i:i + batch_size]])
+
+    responses = await asyncio.gather(*[
+        client.post("/dna/intent/api/v1/image/distribution", json=batch) for batch in batches
+    ])
+
+    return [response["response"]["taskId"] for response in responses]
+
+
+# Activate image on any given device. Returns ({uuid: task id}, {uuid: error}), same as dnac.image_activation, where
+# the second item has every device whose activation request was refused.
+async def image_activation(client, uuid_list, image_id):
+    async def activate(dev_id):
+        body = [{
+            "activateLowerImageVersion": True,
+            "deviceUuid": dev_id,
+            "imageUuidList": [image_id]
+        }]
+        response = await client.post("/dna/intent/api/v1/image/activation/device", json=body)
+
+        return response["response"]["taskId"]
+
+    results = await asyncio.gather(*[activate(dev_id) for dev_id in uuid_list], return_exceptions=True)
+    tasks = {}
+    failed = {}
+
+    for dev_id, result in zip(uuid_list, results):
+        if isinstance(result, Exception):
+            failed[dev_id] = str(result) or type(result).__name__
+        else:
+            tasks[dev_id] = result
+
+    return tasks, failed
+
+
+async def get_task(client, task_id):
+    return await client.get(f"/dna/intent/api/v1/task/{task_id}")
+
+
+# Gets task details given a task id.
+async def get_task_detail(client, task_id):
+    return (await client.get(f"/api/v1/image/task?taskUuid={task_id}"))["response"]
+
+
+async def deploy_template(client, template_id, devices):
+    payload = {
+        "forcePushTemplate": True,
+        "targetInfo": devices,  # within this variable we can pass up to 100 devices to be provisioned in one job
+        "templateId": template_id
+    }
+
+    response = await client.post("/dna/intent/api/v1/template-programmer/template/deploy", json=payload)
+
+    return response.get('deploymentId').split()[-1]
+
+
+async def check_deployment_status(client, deployment_id):
+    response = await client.get(f"/dna/intent/api/v1/template-programmer/template/deploy/status/{deployment_id}")
+
+    return response["devices"]
+
+
+async def claim_site_pnp(client, deviceid, hostname, variables, template_id=None):
+    body = site_claim_payload(deviceid, hostname, variables)
+
+    return await client.post("/api/v1/onboarding/pnp-device/site-claim", json=body)
+
+
+async def claim_device_pnp(client, deviceid, hostname, template_id, image_id=None):
+    body = device_claim_payload(deviceid, hostname, template_id, image_id)
+
+    return await client.post("/api/v1/onboarding/pnp-device/claim", json=body)
+
+
+# Every PnP device waiting to be claimed, paged until a short page so none past the first 1000 are dropped.
+async def get_device_list_ready_to_claim(client):
+    limit = 1000  # Do NOT set limit over 1000 as per DNAC documentation.
+    devices = []
+    offset = 0
+
+    while True:
+        page = await client.get(f"/api/v1/onboarding/pnp-device?state=Unclaimed%2CPlanned&offset={offset}"
+                                f"&limit={limit}")
+        devices.extend(page)
+
+        if len(page) < limit:
+            return devices
+
+        offset += limit
@@ -0,0 +1,164 @@
+# Load control for work pushed at DNAC.
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Endpoint class -> (path pattern, max requests in flight, requests/sec, burst). The first matching class is used.
+ENDPOINT_LIMITS = {
+    "distribution": (r"/image/distribution", 4, 1.0, 2),
+    "activation": (r"/image/activation", 8, 2.5, 5),
+    "task": (r"/task\b|/deploy/status/", 16, 20.0, 20),
+    "template_deploy": (r"/template-programmer/template/deploy$", 4, 2.0, 4),
+    "pnp_claim": (r"/onboarding/pnp-device/(site-)?claim", 8, 5.0, 5),
+    "inventory": (r"/network-device|/device-health|/device-detail|/site|/tag|/onboarding/pnp-device", 8, 10.0, 10),
+    "default": (r"", 8, 10.0, 10)
+}
+
+
+# Token bucket shared by worker threads. Allows `rate` requests per second on average with bursts of up to `burst`.
+# A rate of 0 means no limit.
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a request may go out.
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# AIMD batch size for image distribution. The size grows by a few devices after every batch the controller handled
+# well and is cut in half when a distribution POST is slow, a batch takes much longer than recent batches, or too many
+# devices in it fail. It never goes above ceiling or below floor.
+class BatchSizer:
+    def __init__(self, initial=20, ceiling=40, floor=5, increase=2, decrease=0.5, latency_limit=10.0,
+                 slowdown_limit=1.5, failure_limit=0.2, smoothing=0.3):
+        self.ceiling = ceiling
+        self.floor = min(floor, ceiling)
+        self.size = max(self.floor, min(initial, ceiling))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_limit = latency_limit  # seconds for the distribution POST to return
+        self.slowdown_limit = slowdown_limit  # batch seconds relative to the typical batch
+        self.failure_limit = failure_limit  # fraction of devices in a batch that failed
+        self.smoothing = smoothing  # weight of the newest batch in the typical batch time
+        self.typical_seconds = None
+
+    # Fixed size batches, for when adaptive sizing is off.
+    @classmethod
+    def fixed(cls, size):
+        return cls(initial=size, ceiling=size, floor=size)
+
+    def _grow(self):
+        self.size = min(self.ceiling, self.size + self.increase)
+
+    def _shrink(self):
+        self.size = max(self.floor, int(self.size * self.decrease))
+
+    # Seconds the controller took to accept a distribution request.
+    def record_latency(self, seconds):
+        if seconds > self.latency_limit:
+            self._shrink()
+
+    # A distribution batch finished: how long it took from submit to done, its size and how many devices failed. A
+    # distribution's time is mostly the image copy, not the device count, so a batch is judged slow on its total time
+    # against a moving average of recent batches. The average follows every batch, so after a shrink the smaller
+    # batches set the bar and healthy ones grow the size back.
+    def record_task(self, seconds, devices, failures):
+        if not devices:
+            return
+
+        slow = self.typical_seconds is not None and seconds > self.typical_seconds * self.slowdown_limit
+
+        if self.typical_seconds is None:
+            self.typical_seconds = seconds
+        else:
+            self.typical_seconds += self.smoothing * (seconds - self.typical_seconds)
+
+        if failures / devices > self.failure_limit or slow:
+            self._shrink()
+        else:
+            self._grow()
+
+
+# Concurrency and rate budget for one endpoint class.
+class EndpointBudget:
+    def __init__(self, max_in_flight, rate, burst):
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+
+
+# Per endpoint class limits for every request a client sends. A request waits (queues) until its class has a free
+# slot and a rate token, so adding concurrency anywhere in the tools can't push more at the controller than the
+# budget allows. limits overrides ENDPOINT_LIMITS entries by name with (max in flight, requests/sec, burst).
+class RequestGovernor:
+    def __init__(self, limits=None):
+        self.patterns = []
+        self.budgets = {}
+
+        for name, (pattern, max_in_flight, rate, burst) in ENDPOINT_LIMITS.items():
+            max_in_flight, rate, burst = (limits or {}).get(name, (max_in_flight, rate, burst))
+            self.patterns.append((name, re.compile(pattern)))
+            self.budgets[name] = EndpointBudget(max_in_flight, rate, burst)
+
+    def classify(self, path):
+        path = path.split("?")[0]
+
+        for name, pattern in self.patterns:
+            if pattern.search(path):
+                return name
+
+    # Hold a slot for one request to path for the duration of the with block.
+    @contextmanager
+    def slot(self, path):
+        budget = self.budgets[self.classify(path)]
+
+        with budget.lock:
+            budget.waiting += 1
+
+        budget.slots.acquire()
+        budget.bucket.acquire()
+
+        with budget.lock:
+            budget.waiting -= 1
+            budget.in_flight += 1
+
+        try:
+            yield
+        finally:
+            with budget.lock:
+                budget.in_flight -= 1
+            budget.slots.release()
+
+    # Requests waiting for a slot, per endpoint class.
+    def queue_depth(self):
+        return {name: budget.waiting for name, budget in self.budgets.items()}
+
+    # Waiting, in flight and configured limit per endpoint class, for tuning.
+    def stats(self):
+        return {name: {"waiting": budget.waiting, "in_flight": budget.in_flight,
+                       "max_in_flight": budget.max_in_flight, "rate": budget.bucket.rate}
+                for name, budget in self.budgets.items()}
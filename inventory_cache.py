@@ -0,0 +1,135 @@
+# On-disk (SQLite) cache of DNAC inventory so back to back script runs don't re-page the whole cluster.
+# Rows are keyed by the DNAC base_url so several clusters can share one cache file.
+#
+# usage example:
+#   cache = InventoryCache()
+#   for device in cache.network_devices(env, refresh=args["refresh"], fields=("hostname", "id")):
+#       ...
+import json
+import sqlite3
+import time
+from dnac import get_templates, iter_network_devices, iter_pnp_devices, paginate
+
+# Seconds a table is served from disk before it is refreshed from DNAC.
+DEFAULT_TTLS = {
+    "network_devices": 15 * 60,
+    "sites": 60 * 60,
+    "tags": 60 * 60,
+    "pnp_devices": 60,  # PnP state moves quickly while onboarding
+    "templates": 60 * 60
+}
+
+
+def _fetch_network_devices(env):
+    return iter_network_devices(env)
+
+
+def _fetch_sites(env):
+    return paginate(env, "/dna/intent/api/v1/site", limit=500)
+
+
+def _fetch_tags(env):
+    return paginate(env, "/dna/intent/api/v1/tag", limit=500)
+
+
+def _fetch_pnp_devices(env):
+    return iter_pnp_devices(env)
+
+
+# The template list isn't paged and keys templates by templateId.
+def _fetch_templates(env):
+    for record in get_templates(env):
+        yield {**record, "id": record["templateId"]}
+
+
+# table -> (function streaming the records from DNAC, function returning a record's last update time or None).
+# Records with no update time are always rewritten on refresh.
+TABLES = {
+    "network_devices": (_fetch_network_devices, lambda record: record.get("lastUpdateTime")),
+    "sites": (_fetch_sites, lambda record: None),
+    "tags": (_fetch_tags, lambda record: None),
+    "pnp_devices": (_fetch_pnp_devices, lambda record: record.get("deviceInfo", {}).get("lastUpdateOn")),
+    "templates": (_fetch_templates, lambda record: None)
+}
+
+
+class InventoryCache:
+    def __init__(self, path="inventory_cache.db", ttls=None):
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.db = sqlite3.connect(path)
+
+        with self.db:
+            for table in TABLES:
+                self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (base_url TEXT, id TEXT, updated INTEGER, "
+                                f"data TEXT, PRIMARY KEY (base_url, id))")
+
+            self.db.execute("CREATE TABLE IF NOT EXISTS refreshes (base_url TEXT, name TEXT, refreshed_at REAL, "
+                            "PRIMARY KEY (base_url, name))")
+
+    def is_stale(self, env, table):
+        row = self.db.execute("SELECT refreshed_at FROM refreshes WHERE base_url = ? AND name = ?",
+                              (env["base_url"], table)).fetchone()
+
+        return row is None or time.time() - row[0] > self.ttls[table]
+
+    # Re-read the table from DNAC. DNAC has no modified-since filter, so every page is read again, but only rows
+    # whose update time moved are rewritten and rows no longer in DNAC are dropped. Changed rows are written
+    # batch_size at a time, each batch its own short transaction, so memory stays flat however large the table is and
+    # the cache file isn't kept locked while DNAC is paged.
+    def refresh(self, env, table, batch_size=500):
+        fetch, get_updated = TABLES[table]
+        base_url = env["base_url"]
+        cached = dict(self.db.execute(f"SELECT id, updated FROM {table} WHERE base_url = ?", (base_url,)))
+        seen = set()
+        changed = []
+
+        for record in fetch(env):
+            updated = get_updated(record)
+            seen.add(record["id"])
+
+            if updated is None or cached.get(record["id"]) != updated:
+                changed.append((base_url, record["id"], updated, json.dumps(record)))
+
+            if len(changed) >= batch_size:
+                with self.db:
+                    self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)", changed)
+                changed = []
+
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)", changed)
+            self.db.executemany(f"DELETE FROM {table} WHERE base_url = ? AND id = ?",
+                                [(base_url, record_id) for record_id in cached if record_id not in seen])
+            self.db.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?)", (base_url, table, time.time()))
+
+    # Force the next read of the table to go back to DNAC, e.g. after the script changed it.
+    def invalidate(self, env, table):
+        with self.db:
+            self.db.execute("DELETE FROM refreshes WHERE base_url = ? AND name = ?", (env["base_url"], table))
+
+    # Yield cached records, refreshing first if the table is past its TTL or refresh is set.
+    def records(self, env, table, refresh=False, fields=None):
+        if refresh or self.is_stale(env, table):
+            self.refresh(env, table)
+
+        for (data,) in self.db.execute(f"SELECT data FROM {table} WHERE base_url = ? ORDER BY rowid",
+                                       (env["base_url"],)):
+            record = json.loads(data)
+            yield {key: record.get(key) for key in fields} if fields else record
+
+    def network_devices(self, env, refresh=False, fields=None):
+        return self.records(env, "network_devices", refresh, fields)
+
+    def sites(self, env, refresh=False, fields=None):
+        return self.records(env, "sites", refresh, fields)
+
+    def tags(self, env, refresh=False, fields=None):
+        return self.records(env, "tags", refresh, fields)
+
+    def pnp_devices(self, env, refresh=False, fields=None):
+        return self.records(env, "pnp_devices", refresh, fields)
+
+    def templates(self, env, refresh=False, fields=None):
+        return self.records(env, "templates", refresh, fields)
+
+    def close(self):
+        self.db.close()
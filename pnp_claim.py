@@ -0,0 +1,177 @@
+# Claim many PnP devices at once. Claims go out from a pool of `workers` threads and are paced by the client's
+# request governor (env['limits']['pnp_claim'] to change it). Each claim's outcome and latency goes into a result
+# table, and transient failures (timeouts, 429, 5xx) are retried with backoff.
+#
+# usage example:
+#   claims = [(sn, pnp_index.uuid_for("serial", sn), hostname, variables) for sn, hostname in ...]
+#   results = site_claim_devices(env, claims)
+#   failed = {sn: row for sn, row in results.items() if row["status"] != "SUCCESS"}
+#
+#   devices = [{"serial": sn, "deviceId": uuid, "hostname": hostname, "templateId": template_id,
+#               "parameters": {"vlan": "100"}, "imageId": None}, ...]
+#   results = bulk_claim_devices(env, devices, chunk_size=50)
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dnac import get_client, site_claim_payload, device_claim_entry, bulk_claim_payload
+
+# HTTP statuses worth another try.
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+# Error text out of a PnP claim response body.
+def claim_error(body):
+    response = body.get("response") if isinstance(body, dict) else None
+
+    if isinstance(response, dict):
+        return response.get("message") or response.get("detail") or response.get("errorCode") or str(response)
+
+    return str(body)[:200]
+
+
+# POST a claim body, retrying transient failures. Returns (status, message, latency, attempts, transient) where status
+# is "SUCCESS" or "ERROR", message is DNAC's response (or the error), latency the seconds the last attempt took and
+# transient whether a final error was one worth retrying (timeout, 429, 5xx) rather than DNAC rejecting the body.
+def post_claim(client, path, body, retries=3, backoff=2):
+    for attempt in range(1, retries + 2):
+        started = time.time()
+
+        try:
+            response = client.post(path, json=body)
+        except Exception as e:  # Connection reset, timeout...
+            latency = time.time() - started
+            error, transient = str(e), True
+        else:
+            latency = time.time() - started
+
+            try:
+                reply = response.json()
+            except ValueError:
+                reply = response.text
+
+            if response.status_code < 300:
+                return "SUCCESS", reply, latency, attempt, False
+
+            error = f"{response.status_code}: {claim_error(reply)}"
+            transient = response.status_code in TRANSIENT_STATUS
+
+        if not transient or attempt > retries:
+            return "ERROR", error, latency, attempt, transient
+
+        time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.8, 1.2))
+
+
+# Site claim every device in claims, a list of (serial, pnp device id, hostname, [vlan, mgmt_ip, vlan_ip, site id]).
+# Returns serial -> {"hostname", "deviceId", "status" ("SUCCESS" or "ERROR"), "message", "latency", "attempts"} where
+# latency is the seconds the successful (or last) attempt took.
+def site_claim_devices(env, claims, workers=8, retries=3, backoff=2, show_progress=True):
+    client = get_client(env)
+
+    def claim(deviceid, hostname, variables):
+        status, reply, latency, attempts, _ = post_claim(client, "/api/v1/onboarding/pnp-device/site-claim",
+                                                         site_claim_payload(deviceid, hostname, variables),
+                                                         retries, backoff)
+        if status == "SUCCESS" and isinstance(reply, dict):
+            reply = reply.get("response")
+
+        return status, reply, latency, attempts
+
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(claim, deviceid, hostname, variables): (sn, deviceid, hostname)
+                   for sn, deviceid, hostname, variables in claims}
+
+        for future in as_completed(futures):
+            sn, deviceid, hostname = futures[future]
+            status, message, latency, attempts = future.result()
+            results[sn] = {"hostname": hostname, "deviceId": deviceid, "status": status, "message": message,
+                           "latency": round(latency, 2), "attempts": attempts}
+
+            if show_progress:
+                print(f" {status} {hostname} {sn} in {latency:.1f}s"
+                      f"{'' if attempts == 1 else f' after {attempts} attempts'}: {message}")
+
+    return results
+
+
+# Per device errors in a bulk claim reply, deviceId -> message. DNAC lists the claimed devices in jsonArrayResponse
+# and puts an error on any entry it could not claim.
+def bulk_claim_errors(reply):
+    errors = {}
+
+    for entry in (reply.get("jsonArrayResponse") or []) if isinstance(reply, dict) else []:
+        if isinstance(entry, dict) and (entry.get("errorCode") or entry.get("errorMessage")):
+            errors[entry.get("deviceId") or entry.get("id")] = entry.get("errorMessage") or entry.get("errorCode")
+
+    return errors
+
+
+# Whether a claim error mentions one of the chunk's devices by id or serial number.
+def names_device(error, chunk):
+    return any(device["deviceId"] in error or device["serial"] in error for device in chunk)
+
+
+# Claim devices with many devices per request. devices is a list of {"serial", "deviceId", "hostname", "templateId",
+# "parameters" (dict of template variables), "imageId" (or None)}. The claim body takes one image and one default
+# template, so devices are grouped by both and every group is cut into chunks of chunk_size devices, each chunk one
+# POST. A chunk DNAC rejects because of particular devices (the error names one of them) is split in half and the
+# halves resubmitted, down to single devices, so one bad device doesn't fail the rest. Transient failures that outlast
+# the retries and errors about the payload as a whole fail the whole chunk. Returns serial -> {"hostname", "deviceId",
+# "status", "message", "latency", "attempts", "devicesInRequest"}.
+def bulk_claim_devices(env, devices, chunk_size=50, workers=4, retries=3, backoff=2, show_progress=True):
+    client = get_client(env)
+    groups = {}
+
+    for device in devices:
+        groups.setdefault((device["templateId"], device.get("imageId")), []).append(device)
+
+    def claim(chunk):
+        template_id, image_id = chunk[0]["templateId"], chunk[0].get("imageId")
+        entries = [device_claim_entry(device["deviceId"], device["hostname"], device["templateId"],
+                                      device.get("parameters")) for device in chunk]
+
+        return post_claim(client, "/api/v1/onboarding/pnp-device/claim",
+                          bulk_claim_payload(entries, template_id, image_id), retries, backoff)
+
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        running = {executor.submit(claim, group[i:i + chunk_size]): group[i:i + chunk_size]
+                   for group in groups.values() for i in range(0, len(group), chunk_size)}
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                chunk = running.pop(future)
+                status, reply, latency, attempts, transient = future.result()
+
+                if status == "ERROR" and len(chunk) > 1 and not transient and names_device(reply, chunk):
+                    # Find the device(s) DNAC objects to
+                    half = len(chunk) // 2
+                    for part in (chunk[:half], chunk[half:]):
+                        running[executor.submit(claim, part)] = part
+                    continue
+
+                errors = bulk_claim_errors(reply) if status == "SUCCESS" else {}
+
+                for device in chunk:
+                    error = errors.get(device["deviceId"])
+                    if status == "SUCCESS" and error is None:
+                        row_status = "SUCCESS"
+                        message = reply.get("message") if isinstance(reply, dict) else reply
+                    else:
+                        row_status, message = "ERROR", error or reply
+
+                    results[device["serial"]] = {"hostname": device["hostname"], "deviceId": device["deviceId"],
+                                                 "status": row_status, "message": message,
+                                                 "latency": round(latency, 2), "attempts": attempts,
+                                                 "devicesInRequest": len(chunk)}
+
+                if show_progress:
+                    failed = sum(1 for device in chunk if results[device["serial"]]["status"] != "SUCCESS")
+                    print(f" Claimed {len(chunk) - failed} of {len(chunk)} devices in one request, {latency:.1f}s"
+                          f"{'' if attempts == 1 else f' after {attempts} attempts'}")
+
+    return results
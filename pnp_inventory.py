@@ -0,0 +1,38 @@
+# PnP device inventory indexed by serial number, state, hostname... (see device_index.PNP_DEVICE_KEYS). Every page
+# of pnp-device is read, concurrently, and sync(states) re-reads only the devices in those states so a staging
+# warehouse of thousands of devices can be followed without pulling all of it each time.
+#
+# usage example:
+#   pnp = PnPInventory(env, InventoryCache().pnp_devices(env, fields=("id", "deviceInfo")))
+#   pnp.sync(["Unclaimed", "Planned"])
+#   ready = pnp.select(state=["Unclaimed", "Planned"], serial=serial_numbers)
+from dnac import iter_pnp_devices
+from device_index import DeviceIndex, PNP_DEVICE_KEYS
+
+
+class PnPInventory(DeviceIndex):
+    def __init__(self, env, records=(), parallel=8):
+        super().__init__(records, keys=PNP_DEVICE_KEYS)
+        self.env = env
+        self.parallel = parallel
+
+    # Re-read the devices in states (every device when None) and update the index. Indexed devices that were in one
+    # of those states but are no longer returned for them are dropped, they come back with their new state the next
+    # time that state is synced. Returns the number of devices read.
+    def sync(self, states=None):
+        seen = set()
+
+        for record in iter_pnp_devices(self.env, states, fields=("id", "deviceInfo"), parallel=self.parallel):
+            self.add(record)
+            seen.add(record["id"])
+
+        stale = self.select(state=list(states)) if states else set(self.devices)
+        for uuid in stale - seen:
+            self.remove(uuid)
+
+        return len(seen)
+
+    # State of the device with this serial number, None when it isn't in PnP.
+    def state_of(self, serial):
+        uuid = self.uuid_for("serial", serial)
+        return self.keys["state"](self.devices[uuid]) if uuid else None
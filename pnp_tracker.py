@@ -0,0 +1,133 @@
+# Follow claimed PnP devices until they are Provisioned or in Error. Every due device is read concurrently, each on
+# its own adaptive interval, and every state a device passes through is timed so slow stages and stuck devices show
+# up without watching the PnP dashboard.
+#
+# usage example:
+#   tracker = OnboardingTracker(env, claimed_device_ids)
+#   for device_id, old_state, new_state in tracker.wait():
+#       print(device_id, old_state, "->", new_state)
+#   print(tracker.latency_distribution())
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dnac import get_client
+from task_poller import AdaptiveInterval
+
+# States a device stays in once it gets there.
+FINAL_STATES = {"Provisioned", "Error"}
+
+
+# Nearest rank percentiles of a list of seconds, None when empty.
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return None
+
+    values = sorted(values)
+    summary = {"min": round(values[0], 1), "max": round(values[-1], 1), "count": len(values)}
+
+    for point in points:
+        summary[f"p{point}"] = round(values[min(len(values) - 1, max(0, -(-point * len(values) // 100) - 1))], 1)
+
+    return summary
+
+
+class OnboardingTracker:
+    def __init__(self, env, device_ids=(), initial=5, maximum=60, workers=8, timeout=3600):
+        self.env = env
+        self.initial = initial
+        self.maximum = maximum
+        self.workers = workers
+        self.timeout = timeout  # seconds after the claim a device is given up on as stuck, None to wait forever
+        self.due = {}  # device id -> time of next poll
+        self.intervals = {}  # device id -> AdaptiveInterval, restarted on every state change
+        self.history = {}  # device id -> [(state, time the state was first seen)], starting with ("Claimed", ...)
+        self.stuck = set()  # devices still not in a final state at the timeout
+
+        for device_id in device_ids:
+            self.add(device_id)
+
+    # Start following a device. claimed_at defaults to now.
+    def add(self, device_id, claimed_at=None):
+        self.due[device_id] = time.time()
+        self.intervals[device_id] = AdaptiveInterval(self.initial, self.maximum)
+        self.history[device_id] = [("Claimed", claimed_at or time.time())]
+
+    def state(self, device_id):
+        return self.history[device_id][-1][0]
+
+    def _fetch(self, device_id):
+        try:
+            response = get_client(self.env).get(f"/dna/intent/api/v1/onboarding/pnp-device/{device_id}")
+            return response.json().get("deviceInfo", {}).get("state")
+        except Exception as e:
+            print(f" Could not read PnP device {device_id}: {e}")
+
+    def _show_progress(self):
+        states = {}
+        for device_id in self.history:
+            states[self.state(device_id)] = states.get(self.state(device_id), 0) + 1
+
+        print(f"\r Devices per state: {states}  ", end='', flush=True)
+
+    # Yield (device_id, old state, new state) every time a device changes state, until every device is in a final
+    # state or has passed the timeout.
+    def wait(self, show_progress=True):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while self.due:
+                now = time.time()
+                ready = [device_id for device_id, at in self.due.items() if at <= now]
+
+                if not ready:
+                    time.sleep(max(0, min(self.due.values()) - now))
+                    continue
+
+                changes = []
+                for device_id, state in zip(ready, executor.map(self._fetch, ready)):
+                    old_state = self.state(device_id)
+
+                    if state and state != old_state:
+                        self.history[device_id].append((state, time.time()))
+                        self.intervals[device_id] = AdaptiveInterval(self.initial, self.maximum)
+                        changes.append((device_id, old_state, state))
+
+                    if self.state(device_id) in FINAL_STATES:
+                        del self.due[device_id]
+                        del self.intervals[device_id]
+                    elif self.timeout and time.time() - self.history[device_id][0][1] > self.timeout:
+                        del self.due[device_id]
+                        del self.intervals[device_id]
+                        self.stuck.add(device_id)
+                    else:
+                        self.due[device_id] = time.time() + self.intervals[device_id].next()
+
+                if show_progress:
+                    self._show_progress()
+
+                for change in changes:
+                    yield change
+
+        if show_progress:
+            print()
+
+    # Seconds the device spent in each state it has left, plus the current state so far.
+    def time_in_state(self, device_id):
+        history = self.history[device_id]
+        ends = [at for _, at in history[1:]] + [None if self.state(device_id) in FINAL_STATES else time.time()]
+
+        return {state: round(end - start, 1) for (state, start), end in zip(history, ends) if end is not None}
+
+    # Seconds from claim to Provisioned over every provisioned device, and time spent per state over every device that
+    # left it, as min/p50/p90/p99/max.
+    def latency_distribution(self):
+        per_state = {}
+        provisioned = []
+
+        for device_id, history in self.history.items():
+            for state, seconds in self.time_in_state(device_id).items():
+                if state != self.state(device_id):
+                    per_state.setdefault(state, []).append(seconds)
+
+            if self.state(device_id) == "Provisioned":
+                provisioned.append(history[-1][1] - history[0][1])
+
+        return {"Claimed -> Provisioned": percentiles(provisioned),
+                **{state: percentiles(seconds) for state, seconds in per_state.items()}}
@@ -0,0 +1,103 @@
+# Site hierarchy index. Maps each full siteNameHierarchy ("Global/SJC/SJ11/Floor 1") to its site id with one dict
+# lookup, and keeps the hierarchy as a trie for "everything under Global/SJC" and "children of SJ11" queries.
+#
+# usage example:
+#   sites = SiteIndex(InventoryCache().sites(env))
+#   site_id = sites.id_for("Global/SJC/SJ11", types=("building", "floor"))
+#   children = sites.children("Global/SJC")
+#   floors = sites.under("Global/SJC", types=("floor",))
+
+
+# area, building or floor from a /site record. Global has no type.
+def site_type(record):
+    for info in record.get("additionalInfo") or []:
+        if info.get("attributes", {}).get("type"):
+            return info["attributes"]["type"]
+
+    return None
+
+
+class SiteIndex:
+    def __init__(self, records=()):
+        self.ids = {}  # siteNameHierarchy -> site id
+        self.records = {}  # site id -> record
+        self.types = {}  # site id -> area/building/floor
+        self.trie = {"id": None, "children": {}}  # one node per hierarchy level
+
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, hierarchy):
+        return hierarchy in self.ids
+
+    def add(self, record):
+        hierarchy = record["siteNameHierarchy"]
+
+        self.ids[hierarchy] = record["id"]
+        self.records[record["id"]] = record
+        self.types[record["id"]] = site_type(record)
+
+        node = self.trie
+        for name in hierarchy.split("/"):
+            node = node["children"].setdefault(name, {"id": None, "children": {}})
+        node["id"] = record["id"]
+
+    def _node(self, hierarchy):
+        node = self.trie
+
+        for name in hierarchy.split("/") if hierarchy else []:
+            node = node["children"].get(name)
+            if node is None:
+                return None
+
+        return node
+
+    # Site id for an exact hierarchy, None when there is no such site or it isn't one of types.
+    def id_for(self, hierarchy, types=None):
+        site_id = self.ids.get(hierarchy)
+
+        if site_id is None or (types and self.types[site_id] not in types):
+            return None
+
+        return site_id
+
+    # Site id for a hierarchy or a site id, None when it is neither or isn't one of types.
+    def resolve(self, value, types=None):
+        if value in self.records:
+            return value if not types or self.types[value] in types else None
+
+        return self.id_for(value, types)
+
+    def get(self, site_id):
+        return self.records.get(site_id)
+
+    # Hierarchies of the sites directly below hierarchy.
+    def children(self, hierarchy):
+        node = self._node(hierarchy)
+        if node is None:
+            return []
+
+        return [f"{hierarchy}/{name}" if hierarchy else name for name in node["children"]]
+
+    # (hierarchy, id) of every site at or below hierarchy ("" for all), optionally only those of the given types.
+    def under(self, hierarchy="", types=None):
+        node = self._node(hierarchy)
+        if node is None:
+            return []
+
+        sites = []
+        stack = [(hierarchy, node)]
+
+        while stack:
+            path, node = stack.pop()
+
+            if node["id"] is not None and (not types or self.types[node["id"]] in types):
+                sites.append((path, node["id"]))
+
+            for name, child in reversed(list(node["children"].items())):
+                stack.append((f"{path}/{name}" if path else name, child))
+
+        return sites
@@ -0,0 +1,101 @@
+# Append-only journal of a SWIM job so a run that dies part way can be resumed with --resume JOB_ID.
+# One JSON object per line: the job itself, every task submitted with its devices, and every task that finished with
+# the devices that succeeded and failed in it. Replaying the lines rebuilds the job's state.
+import json
+import os
+import threading
+import time
+
+PHASES = ("distribution", "activation")
+
+
+# Where a job stands after replaying its journal.
+class JobState:
+    def __init__(self):
+        self.image_id = None
+        self.devices = []
+        self.distribute = False
+        self.activate = False
+        self.pipeline = False
+        self.done = {phase: set() for phase in PHASES}  # uuids that finished the phase
+        self.failed = {phase: {} for phase in PHASES}  # uuid -> reason
+        self.outstanding = {phase: {} for phase in PHASES}  # task id -> uuids, submitted but not seen to finish
+
+    def apply(self, entry):
+        if entry["event"] == "job":
+            self.image_id = entry["image_id"]
+            self.devices = entry["devices"]
+            self.distribute = entry["distribute"]
+            self.activate = entry["activate"]
+            self.pipeline = entry["pipeline"]
+
+        elif entry["event"] == "submitted":
+            self.outstanding[entry["phase"]][entry["task_id"]] = entry["devices"]
+
+        elif entry["event"] == "finished":
+            self.outstanding[entry["phase"]].pop(entry["task_id"], None)
+            self.done[entry["phase"]].update(entry["succeeded"])
+            self.failed[entry["phase"]].update(entry["failed"])
+
+    def _busy(self, phase):
+        return {dev_id for devices in self.outstanding[phase].values() for dev_id in devices}
+
+    # Devices still to be submitted for distribution.
+    def pending_distribution(self):
+        skip = self.done["distribution"] | set(self.failed["distribution"]) | self._busy("distribution")
+        return [dev_id for dev_id in self.devices if dev_id not in skip]
+
+    # Devices ready for activation that have not been submitted yet. Without distribution in the job every device is
+    # ready.
+    def pending_activation(self):
+        ready = self.done["distribution"] if self.distribute else set(self.devices)
+        skip = self.done["activation"] | set(self.failed["activation"]) | self._busy("activation")
+        return [dev_id for dev_id in self.devices if dev_id in ready and dev_id not in skip]
+
+
+class SwimJournal:
+    def __init__(self, log_dir, job_id=None):
+        self.job_id = job_id or time.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(log_dir, "SWIM_Jobs", f"journal_{self.job_id}.jsonl")
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        # A run killed mid write leaves a half line. End it so the next event starts on its own line.
+        if self.exists() and os.path.getsize(self.path):
+            with open(self.path, "rb+") as journal:
+                journal.seek(-1, os.SEEK_END)
+                if journal.read(1) != b"\n":
+                    journal.write(b"\n")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def record(self, event, **fields):
+        line = json.dumps({"time": time.time(), "event": event, **fields})
+
+        with self.lock, open(self.path, "a") as journal:
+            journal.write(line + "\n")
+
+    def start(self, image_id, devices, distribute, activate, pipeline):
+        self.record("job", image_id=image_id, devices=devices, distribute=distribute, activate=activate,
+                    pipeline=pipeline)
+
+    def submitted(self, phase, task_id, devices):
+        self.record("submitted", phase=phase, task_id=task_id, devices=devices)
+
+    # task_id is None for devices DNAC refused before a task was created.
+    def finished(self, phase, task_id, succeeded, failed):
+        self.record("finished", phase=phase, task_id=task_id, succeeded=succeeded, failed=failed)
+
+    def load(self):
+        state = JobState()
+
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    state.apply(json.loads(line))
+                except ValueError:  # Half written last line from a run that was killed
+                    continue
+
+        return state
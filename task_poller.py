@@ -0,0 +1,295 @@
+# Poll many DNAC tasks (or template deployments) in one loop. Every due task is fetched concurrently and a completion
+# event is yielded as soon as that task finishes, so results track the slowest task instead of the sum of all of them.
+#
+# usage example:
+#   poller = TaskPoller(env, task_ids)
+#   for task_id, result in poller.wait():
+#       print(task_id, result["Success"], result["Failure"])
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dnac import get_client, check_deployment_status
+
+# Template deployment statuses that mean the device has not finished yet.
+DEPLOYMENT_RUNNING = {"INIT", "NOT_STARTED", "PENDING", "IN_PROGRESS"}
+
+
+# Turn a SWIM task progress string ("success=3,failure=1,running=0,pending=0,...,total=4") into counts.
+# Returns None while the task has not started counting yet ("Starting Distribution", "image activation").
+def parse_task_progress(progress):
+    task = (progress or "").split(',')
+
+    try:
+        return {
+            "Success": int(task[0].split('=')[-1]),
+            "Failure": int(task[1].split('=')[-1]),
+            "Running": int(task[2].split('=')[-1]),
+            "Pending": int(task[3].split('=')[-1]),
+            "Total": int(task[-1].split('=')[-1])
+        }
+
+    except (IndexError, ValueError):
+        return None
+
+
+# Poll interval for one job. Starts short so immediate failures are seen quickly, then backs off with jitter. Once the
+# job reports progress the completion rate is used to predict when it will finish, and the next poll is brought
+# forward to that time when it is sooner than the backoff.
+class AdaptiveInterval:
+    def __init__(self, initial=2, maximum=60, factor=1.5, jitter=0.2, window=5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.backoff = initial
+        self.samples = deque(maxlen=window)  # (time, fraction complete)
+
+    # Seconds until the job finishes at the rate seen over the last few polls, None until it has moved.
+    def predict(self):
+        if len(self.samples) < 2:
+            return None
+
+        (t0, f0), (t1, f1) = self.samples[0], self.samples[-1]
+        if f1 <= f0 or t1 <= t0:
+            return None
+
+        return (1 - f1) / ((f1 - f0) / (t1 - t0))
+
+    # Seconds to wait before the next poll. done/total is how much of the job has finished so far, when known.
+    def next(self, done=None, total=None):
+        if total:
+            self.samples.append((time.time(), done / total))
+
+        interval = self.backoff
+        self.backoff = min(self.maximum, self.backoff * self.factor)
+
+        eta = self.predict()
+        if eta is not None:
+            interval = min(interval, eta)
+
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        return min(self.maximum, max(self.initial, interval))
+
+
+# A task DNAC says does not exist max_errors polls in a row (e.g. an old id it has purged) is given up on, finishes
+# with an "Error" result and its id is then in self.failed. Polls that fail for any other reason (timeouts, 5xx, a
+# controller restart) are retried until the task can be read again.
+class TaskPoller:
+    def __init__(self, env, task_ids=(), initial=2, maximum=60, workers=8, max_errors=5):
+        self.env = env
+        self.initial = initial
+        self.maximum = maximum
+        self.workers = workers
+        self.max_errors = max_errors
+        self.due = {}  # task_id -> time of next poll
+        self.errors = {}  # task_id -> "no such task" replies in a row
+        self.failed = set()
+        self.status = {}  # task_id -> last parsed progress, None until the task reports counts
+        self.intervals = {}  # task_id -> AdaptiveInterval
+
+        for task_id in task_ids:
+            self.add(task_id)
+
+    # Start tracking a task. Safe to call while wait() is running, e.g. from the loop consuming its events.
+    def add(self, task_id):
+        self.due[task_id] = time.time()
+        self.status[task_id] = None
+        self.intervals[task_id] = AdaptiveInterval(self.initial, self.maximum)
+
+    # (task body, whether DNAC replied that there is no such task). The body is None when the poll failed.
+    def _fetch(self, task_id):
+        try:
+            response = get_client(self.env).get(f"/dna/intent/api/v1/task/{task_id}")
+            task = response.json().get("response")
+        except Exception as e:
+            print(f" Could not poll task {task_id}: {e}")
+            return None, False
+
+        return task if isinstance(task, dict) else None, response.status_code in (400, 404)
+
+    # Returns the result dict when the task is finished, None while it is still running.
+    def _check(self, task_id, task, missing):
+        if task is None or ("progress" not in task and not task.get("isError")):  # Poll failed or not a task body
+            if not missing:
+                return None
+
+            self.errors[task_id] = self.errors.get(task_id, 0) + 1
+
+            if self.errors[task_id] >= self.max_errors:
+                self.failed.add(task_id)
+                reason = (task or {}).get("detail") or (task or {}).get("message") or (task or {}).get("errorCode")
+                return {"Success": 0, "Failure": 0, "Running": 0, "Pending": 0, "Total": 0,
+                        "Error": f"DNAC has no such task ({reason or 'not found'})"}
+
+            return None
+
+        self.errors[task_id] = 0
+
+        result = parse_task_progress(task.get("progress"))
+        self.status[task_id] = result
+
+        if result is not None and result["Running"] == 0 and result["Pending"] == 0:
+            return result
+
+        if task.get("isError"):  # Task died before it reported device counts
+            return {"Success": 0, "Failure": 0, "Running": 0, "Pending": 0, "Total": 0,
+                    "Error": task.get("failureReason")}
+
+        return None
+
+    def _schedule(self, task_id):
+        result = self.status[task_id]
+
+        if result:
+            wait = self.intervals[task_id].next(result["Success"] + result["Failure"], result["Total"])
+        else:
+            wait = self.intervals[task_id].next()
+
+        self.due[task_id] = time.time() + wait
+
+    # Print a one line summary of every tracked task.
+    def _show_progress(self, finished):
+        counts = [result for result in self.status.values() if result]
+        running = sum(result["Running"] + result["Pending"] for result in counts)
+        queued = sum(get_client(self.env).governor.queue_depth().values())  # Requests waiting on the governor
+        print(f"\r Tasks finished: {finished}/{finished + len(self.due)}, devices still in progress: {running}, "
+              f"queued requests: {queued}  ", end='', flush=True)
+
+    # Yield (task_id, result) as each task finishes until no tracked task is left.
+    def wait(self, show_progress=True):
+        finished = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while self.due:
+                now = time.time()
+                ready = [task_id for task_id, at in self.due.items() if at <= now]
+
+                if not ready:
+                    time.sleep(max(0, min(self.due.values()) - now))
+                    continue
+
+                completed = []
+                for task_id, (task, missing) in zip(ready, executor.map(self._fetch, ready)):
+                    result = self._check(task_id, task, missing)
+
+                    if result is None:
+                        self._schedule(task_id)
+                    else:
+                        del self.due[task_id]
+                        del self.intervals[task_id]
+                        self.errors.pop(task_id, None)
+                        completed.append((task_id, result))
+
+                finished += len(completed)
+                if show_progress:
+                    self._show_progress(finished)
+
+                for event in completed:
+                    yield event
+
+        if show_progress:
+            print()
+
+
+# Poll many template deployments in one loop, each on its own adaptive interval. Yields
+# (deployment_id, changed device records, finished) every time a device in a deployment moves to a new status, and
+# once more with finished=True when every device in it is done. A deployment that can't be read max_errors polls in a
+# row (e.g. an old id DNAC no longer has) is given up on and reported finished, its id is then in self.failed.
+#
+# usage example:
+#   poller = DeploymentPoller(env, deployment_ids)
+#   for deployment_id, changes, finished in poller.wait():
+#       for device in changes:
+#           print(deployment_id, device["name"], device["status"])
+class DeploymentPoller:
+    def __init__(self, env, deployment_ids=(), initial=2, maximum=60, workers=8, max_errors=5):
+        self.env = env
+        self.initial = initial
+        self.maximum = maximum
+        self.workers = workers
+        self.max_errors = max_errors
+        self.due = {}  # deployment_id -> time of next poll
+        self.errors = {}  # deployment_id -> failed polls in a row
+        self.failed = set()
+        self.intervals = {}  # deployment_id -> AdaptiveInterval
+        self.devices = {}  # deployment_id -> deviceId -> last device record
+
+        for deployment_id in deployment_ids:
+            self.add(deployment_id)
+
+    # Start tracking a deployment. Safe to call while wait() is running.
+    def add(self, deployment_id):
+        self.due[deployment_id] = time.time()
+        self.intervals[deployment_id] = AdaptiveInterval(self.initial, self.maximum)
+        self.devices.setdefault(deployment_id, {})
+
+    # Last seen device records of a deployment.
+    def results(self, deployment_id):
+        return list(self.devices.get(deployment_id, {}).values())
+
+    def _fetch(self, deployment_id):
+        try:
+            return check_deployment_status(self.env, deployment_id)
+        except Exception as e:
+            print(f" Could not poll deployment {deployment_id}: {e}")
+
+    # Device records whose status moved since the last poll.
+    def _update(self, deployment_id, devices):
+        known = self.devices[deployment_id]
+        changes = []
+
+        for device in devices:
+            previous = known.get(device.get("deviceId"))
+            if previous is None or previous.get("status") != device.get("status"):
+                changes.append(device)
+            known[device.get("deviceId")] = device
+
+        return changes
+
+    def _show_progress(self):
+        devices = [device for records in self.devices.values() for device in records.values()]
+        running = sum(1 for device in devices if device.get("status") in DEPLOYMENT_RUNNING)
+        print(f"\r Deployments still running: {len(self.due)}, devices still in progress: {running}  ",
+              end='', flush=True)
+
+    def wait(self, show_progress=True):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while self.due:
+                now = time.time()
+                ready = [deployment_id for deployment_id, at in self.due.items() if at <= now]
+
+                if not ready:
+                    time.sleep(max(0, min(self.due.values()) - now))
+                    continue
+
+                events = []
+                for deployment_id, devices in zip(ready, executor.map(self._fetch, ready)):
+                    self.errors[deployment_id] = 0 if devices is not None else self.errors.get(deployment_id, 0) + 1
+                    if self.errors[deployment_id] >= self.max_errors:
+                        self.failed.add(deployment_id)
+
+                    devices = devices or []
+                    changes = self._update(deployment_id, devices)
+                    done = sum(1 for device in devices if device.get("status") not in DEPLOYMENT_RUNNING)
+                    finished = (bool(devices) and done == len(devices)) or deployment_id in self.failed
+
+                    if finished:
+                        del self.due[deployment_id]
+                        del self.intervals[deployment_id]
+                    else:
+                        self.due[deployment_id] = time.time() + self.intervals[deployment_id].next(done, len(devices))
+
+                    if changes or finished:
+                        events.append((deployment_id, changes, finished))
+
+                if show_progress:
+                    self._show_progress()
+
+                for event in events:
+                    yield event
+
+        if show_progress:
+            print()
+
@@ -0,0 +1,60 @@
+# The template programmer catalog indexed by project, template name and version, so picking a project and then a
+# template is a dict lookup instead of another download of every template.
+#
+# usage example:
+#   catalog = TemplateCatalog(InventoryCache().templates(env))
+#   for project in catalog.projects():
+#       print(project, catalog.names(project))
+#   template_id = catalog.template_id("Onboarding Configuration", "reset_switch")
+#   pinned_id = catalog.template_id("Onboarding Configuration", "reset_switch", version="3")
+
+
+class TemplateCatalog:
+    def __init__(self, records=()):
+        self.templates = {}  # templateId -> record
+        self.by_project = {}  # project name -> template name -> templateId
+        self.versions = {}  # templateId -> version -> id of that committed version
+
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def add(self, record):
+        template_id = record["templateId"]
+
+        self.templates[template_id] = record
+        self.by_project.setdefault(record["projectName"], {})[record["name"]] = template_id
+        self.versions[template_id] = {str(version["version"]): version["id"]
+                                      for version in record.get("versionsInfo") or []}
+
+    # Project names in the order DNAC listed them.
+    def projects(self):
+        return list(self.by_project)
+
+    # Template names in a project.
+    def names(self, project):
+        return list(self.by_project.get(project, {}))
+
+    # (name, templateId) for every template in a project.
+    def templates_in(self, project):
+        return list(self.by_project.get(project, {}).items())
+
+    # Committed version numbers of a template, oldest first.
+    def template_versions(self, project, name):
+        template_id = self.by_project.get(project, {}).get(name)
+        return sorted(self.versions.get(template_id, {}), key=lambda version: int(version) if version.isdigit() else 0)
+
+    # Id to deploy for an exact project and template name, None if there is no such template. Without a version the
+    # template itself is used, which deploys its latest committed version.
+    def template_id(self, project, name, version=None):
+        template_id = self.by_project.get(project, {}).get(name)
+
+        if template_id is None or version is None:
+            return template_id
+
+        return self.versions[template_id].get(str(version))
+
+    def get(self, template_id):
+        return self.templates.get(template_id)
@@ -0,0 +1,105 @@
+# Push a template to any number of devices and verify it. Targets are split into groups small enough for one
+# deployment (DNAC takes fewer than 100 devices per deploy), groups are submitted concurrently with at most
+# max_in_flight deployments running at once, and every deployment is polled in one loop until each device has a final
+# status.
+#
+# usage example:
+#   table, groups = deploy_template_groups(env, template_id, get_devices_by_tag(env, tag_id))
+#   failed = [row for row in table.values() if row["status"] != "SUCCESS"]
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dnac import deploy_template
+from task_poller import DEPLOYMENT_RUNNING, DeploymentPoller
+
+
+# Returns (table, groups). table is deviceId -> {"hostname", "group", "deploymentId", "status", "message"}, with status
+# "UNKNOWN" for devices of a deployment whose status could no longer be read (that group gets an error). groups is
+# one {"group", "devices", "deploymentId", "submitted", "finished", "seconds", "error"} entry per group. targets are
+# targetInfo entries as returned by dnac.get_devices_by_tag. on_submit(deployment_id) is called as each deployment
+# is accepted, e.g. to record its id before polling starts. max_in_flight of 0 submits every group at once.
+def deploy_template_groups(env, template_id, targets, group_size=99, max_in_flight=4, on_submit=None,
+                           show_progress=True):
+    group_list = [targets[i:i + group_size] for i in range(0, len(targets), group_size)]
+    waiting = deque(range(len(group_list)))
+    running = {}  # deployment id -> group number
+    groups = [{"group": number, "devices": len(group), "deploymentId": None, "submitted": None, "finished": None,
+               "seconds": None, "error": None} for number, group in enumerate(group_list)]
+    table = {target["id"]: {"hostname": target.get("hostName"), "group": number, "deploymentId": None,
+                            "status": "PENDING", "message": None}
+             for number, group in enumerate(group_list) for target in group}
+    poller = DeploymentPoller(env)
+
+    def submit(number):
+        groups[number]["submitted"] = time.time()
+
+        try:
+            return deploy_template(env, template_id, group_list[number]), None
+        except Exception as e:
+            return None, str(e)
+
+    def submit_groups():
+        numbers = []
+        while waiting and (not max_in_flight or len(running) + len(numbers) < max_in_flight):
+            numbers.append(waiting.popleft())
+
+        if not numbers:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(numbers)) as executor:
+            for number, (deployment_id, error) in zip(numbers, executor.map(submit, numbers)):
+                if deployment_id is None:  # Deployment refused, the whole group failed
+                    groups[number].update(finished=time.time(), error=error)
+                    for target in group_list[number]:
+                        table[target["id"]].update(status="FAILURE", message=error)
+                    print(f" Group {number} ({len(group_list[number])} devices) was not deployed: {error}")
+                    continue
+
+                groups[number]["deploymentId"] = deployment_id
+                running[deployment_id] = number
+                poller.add(deployment_id)
+
+                for target in group_list[number]:
+                    table[target["id"]]["deploymentId"] = deployment_id
+
+                if on_submit:
+                    on_submit(deployment_id)
+
+    submit_groups()
+    while waiting and not running:  # Every group so far was refused, keep going with the rest
+        submit_groups()
+
+    for deployment_id, changes, finished in poller.wait(show_progress):
+        for device in changes:
+            row = table.setdefault(device.get("deviceId"), {"hostname": device.get("name"),
+                                                             "group": running.get(deployment_id),
+                                                             "deploymentId": deployment_id})
+            row.update(status=device.get("status"), message=device.get("detailedStatusMessage"))
+
+        if finished:
+            group = groups[running.pop(deployment_id)]
+            group["finished"] = time.time()
+            group["seconds"] = round(group["finished"] - group["submitted"], 1)
+
+            if deployment_id in poller.failed:  # Status could not be read, devices not seen to finish are unknown
+                group["error"] = f"Deployment {deployment_id} status could not be read"
+                for row in table.values():
+                    if row["deploymentId"] == deployment_id and row["status"] in DEPLOYMENT_RUNNING:
+                        row.update(status="UNKNOWN", message=group["error"])
+                print(f" Group {group['group']} ({group['devices']} devices): {group['error']}, giving up on it.")
+
+            submit_groups()
+            while waiting and not running:
+                submit_groups()
+
+    return table, groups
+
+
+# Device count per final status, e.g. {"SUCCESS": 2950, "FAILURE": 50}.
+def summarize(table):
+    counts = {}
+
+    for row in table.values():
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+
+    return counts